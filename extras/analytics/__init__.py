@@ -0,0 +1 @@
+# The analytics report for timecheck22 as a package: run it with `python -m analytics` from extras/ (or `python analyze.py` from here; see analyze.py for options), or import it, e.g. analytics.analyze.AnalyticsData
@@ -0,0 +1,3 @@
+from .analyze import main
+
+main()
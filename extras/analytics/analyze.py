@@ -1,446 +1,331 @@
-import pandas as pd
-from scipy import stats
-import country_converter as coco
+import argparse
+import functools
+import numpy as np
 import os
-from datetime import datetime, UTC
-
-# Declare logging/file-writing/printing handler; define util functions & values
-does_write_print = True
-lines_to_write = []
-def write (*args):
-	if does_write_print: print(*args)
-	args = map(str, args)
-	lines_to_write.append(' '.join(args) + '\n')
-
-def times (quantity, words='time', pluralizer=None):
-	if isinstance(words, str):
-		single = words
-		if pluralizer == None: pluralizer = 's'
-		plural = words + pluralizer
-	else:
-		single = words[0]
-		if pluralizer == None: pluralizer = ''
-		plural = words[1] + pluralizer
-	return str(quantity) + ' ' + (single if quantity == 1 else plural)
-
-UMAMI_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
-
-# Get time bounds if necessary
-if __name__ == '__main__':
-	start_bound = input('Enter the starting bound date, if applicable: ')
-	if start_bound:
-		try: start_bound = datetime.strptime(start_bound, '%Y-%m-%d')
-		except ValueError: pass
-		try: start_bound = datetime.strptime(start_bound, UMAMI_TIMESTAMP_FORMAT)
-		except (ValueError, TypeError): pass # expected ValueError if invalid format, TypeError if already datetime
-		if isinstance(start_bound, str):
-			print('Invalid starting bound, exiting.')
-			exit(1)
-	end_bound = input('Enter the ending bound date, if applicable: ')
-	if end_bound:
-		try: end_bound = datetime.strptime(end_bound, '%Y-%m-%d')
-		except ValueError: pass
-		try: end_bound = datetime.strptime(end_bound, UMAMI_TIMESTAMP_FORMAT)
-		except (ValueError, TypeError): pass # expected ValueError if invalid format, TypeError if already datetime
-		if isinstance(end_bound, str):
-			print('Invalid ending bound, exiting.')
-			exit(1)
-
-# Find CSVs
+from datetime import datetime
+if __name__ == '__main__' and not __package__:
+	# Run as a script (python analyze.py, as before this was a package): run the package instead, as python -m analytics would, so the relative imports below work
+	import runpy
+	import sys
+	package_dir = os.path.dirname(os.path.abspath(__file__))
+	sys.path.insert(0, os.path.dirname(package_dir))
+	runpy.run_module(os.path.basename(package_dir), run_name='__main__', alter_sys=True)
+	sys.exit()
+from .encoding import ExportIds
+from .ingest import DEFAULT_EXPORT_DIR, UMAMI_TIMESTAMP_FORMAT, TableSummary, concat_frames, export_csv_path, read_export_table
+from .cleaning import DEV_SESSION_ROWS_SQL, DROPPED_EVENT_ROWS_SQL, ExportFacts, cleaning_constants, cleaning_stages, earlier_rows_stages, spam_lookback, whole_table_rows
+from .cache import DEFAULT_CACHE_DIR, CleanedFrameCache, has_parquet
+from .incremental import IncrementalState
+from .dataset import ExportDataset, export_input_paths, is_dataset
+from .database import UmamiDatabase, is_database
+from .pipeline import FilterStage, Instrumentation, compute_sections, run_filters
+from .report import ReportWindow, format_window, report_renderers, report_sections, series_renderers
+from .windows import WindowIndex, parse_period, period_windows
+from .parallel import compute_sections_parallel
+
+# Default locations, all relative to this package (see also ingest.DEFAULT_EXPORT_DIR and cache.DEFAULT_CACHE_DIR)
 script_dir = os.path.dirname(__file__)
-csv_base = 'exports/tc22-umami-data-2026-jan-25/'
-session_data_csv_path = os.path.join(script_dir, csv_base + 'session_data.csv')
-event_data_csv_path = os.path.join(script_dir, csv_base + 'event_data.csv')
-website_event_csv_path = os.path.join(script_dir, csv_base + 'website_event.csv')
-analytics_report_file_path = os.path.join(script_dir, 'latest_analytics_report.txt')
-
-# Load session data
-sd_df = pd.read_csv(session_data_csv_path, parse_dates=['created_at'])
-sd_df = sd_df.drop(columns=['website_id', 'number_value', 'date_value', 'data_type', 'distinct_id', 'job_id'])
-
-# Remove out of range data
-user_sessions = sd_df
-if start_bound:
-	user_sessions = user_sessions[user_sessions['created_at'] > start_bound]
-if end_bound:
-	user_sessions = user_sessions[user_sessions['created_at'] < end_bound]
-
-# Get developer/old sessions
-cond_1 = ((sd_df['data_key'] == 'env') & (sd_df['string_value'] == 'dev')) # env=dev
-cond_2 = (sd_df['data_key'] == 'profile') # profile=[identifier for one of my testing devices]
-cond_3 = ((sd_df['data_key'] == 'schoolId') & (sd_df['string_value'] == '2') & (sd_df['created_at'] > '2025-12-20') & (sd_df['created_at'] < '2025-12-31')) # no production Cal Aero (schoolId: 2) users during 2025 Dec 20-31, only developers
-dev_session_mask = (cond_1 | cond_2 | cond_3)
-dev_sessions = sd_df[dev_session_mask]
-dev_ids = dev_sessions['session_id'].unique()
-
-# Get user sessions
-user_sessions = user_sessions[~user_sessions['session_id'].isin(dev_ids)]
-user_ids = user_sessions['session_id'].unique()
-
-# Load website events data, drop extraneous/unnecessary columns
-we_df = pd.read_csv(website_event_csv_path, parse_dates=['created_at'])
-we_df = we_df.drop(columns=['website_id', 'url_query', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'referrer_path', 'referrer_query', 'page_title', 'gclid', 'fbclid', 'msclkid', 'ttclid', 'li_fat_id', 'twclid', 'tag', 'distinct_id', 'job_id'])
-
-# Remove out of range events
-user_we_events = we_df
-if start_bound:
-	user_we_events = user_we_events[user_we_events['created_at'] > start_bound]
-if end_bound:
-	user_we_events = user_we_events[user_we_events['created_at'] < end_bound]
-
-# Get developer/old visits
-# analytics events were added in commit e2eebadce74aefe153aef4a71d7b4bf931cc5861, although theoretically older visits COULD still be valid
-ANALYTICS_ADDED_TS = '2025-12-13 09:30:00'
-bad_we_visits_mask = (
-	(we_df['created_at'] < ANALYTICS_ADDED_TS) |
-	(we_df['session_id'].isin(dev_ids))
-)
-bad_we_visits = we_df[bad_we_visits_mask]
-bad_we_visit_ids = bad_we_visits['visit_id'].unique()
-bad_we_event_ids = bad_we_visits['event_id'].unique()
-
-# Get real valid user events
-user_we_events = user_we_events[~user_we_events['visit_id'].isin(bad_we_visit_ids)]
-
-# Load event data
-ed_df = pd.read_csv(event_data_csv_path, parse_dates=['created_at'])
-ed_df = ed_df.drop(columns=['website_id', 'url_path', 'number_value', 'date_value', 'data_type', 'job_id']) # note to self: remove 'url_path' from drop list when other pages get events on them
-
-# Remove out of range events
-valid_ed_events = ed_df
-if start_bound:
-	valid_ed_events = valid_ed_events[valid_ed_events['created_at'] > start_bound]
-if end_bound:
-	valid_ed_events = valid_ed_events[valid_ed_events['created_at'] < end_bound]
-
-# Filter out invalid data
-# old notes-updated events fired too much before a bugfix was committed (de24e77862d4dcc3c2a3340fdb6dabb60e06cacc)
-NOTES_UPDATED_OVERFIRE_FIXED_TS = '2025-12-31 12:15'
-valid_notes_updated_event_ids = ed_df[(
-	(ed_df['event_name'] == 'notes-updated') &
-	(ed_df['data_key'] == 'length')
-)][['session_id', 'event_id', 'string_value']].drop_duplicates(subset=['session_id', 'string_value'])['event_id'].unique()
-valid_ed_events = valid_ed_events[~(
-	(valid_ed_events['event_name'] == 'notes-updated') &
-	(valid_ed_events['created_at'] < NOTES_UPDATED_OVERFIRE_FIXED_TS) &
-	(~valid_ed_events['event_id'].isin(valid_notes_updated_event_ids))
-)]
-user_we_events = user_we_events[~(
-	(user_we_events['event_name'] == 'notes-updated') &
-	(user_we_events['created_at'] < NOTES_UPDATED_OVERFIRE_FIXED_TS) &
-	(~user_we_events['event_id'].isin(valid_notes_updated_event_ids))
-)]
-# Remove bad events as defined above
-valid_ed_events = valid_ed_events[~valid_ed_events['event_id'].isin(bad_we_event_ids)]
-# Filter out spam events
-sorted_ed = ed_df.sort_values(['session_id', 'created_at'])
-sorted_ed['time_delta'] = sorted_ed.groupby(['session_id', 'event_name', 'data_key', 'string_value'])['created_at'].diff()
-event_spam_threshold = pd.Timedelta(seconds=1)
-spam_event_ids = sorted_ed[~((sorted_ed['time_delta'].isna()) | (sorted_ed['time_delta'] > event_spam_threshold))]['event_id'].unique()
-valid_ed_events = valid_ed_events[~valid_ed_events['event_id'].isin(spam_event_ids)]
-user_we_events = user_we_events[~user_we_events['event_id'].isin(spam_event_ids)]
-# Filter out spam views
-sorted_we = we_df.sort_values(['session_id', 'created_at'])
-sorted_we['time_delta'] = sorted_we.groupby(['session_id', 'event_type'])['created_at'].diff()
-view_spam_threshold = pd.Timedelta(seconds=10)
-spam_view_event_ids = sorted_we[~((sorted_we['time_delta'].isna()) | (sorted_we['time_delta'] > view_spam_threshold) | (sorted_we['event_type'] == 2))]['event_id'].unique()
-user_we_events = user_we_events[~user_we_events['event_id'].isin(spam_view_event_ids)]
-
-
-
-# Get country names from Umami source data (ISO 3166-1 alpha-2 country codes)
-country_subset = user_we_events[['session_id', 'country']].drop_duplicates()
-cc = coco.CountryConverter()
-country_codes = country_subset['country'].unique()
-countries = []
-for country_code in country_codes:
-	country_name = cc.convert(names=country_code, to='name')
-	country_count = len(country_subset[country_subset['country'] == country_code])
-	countries.append(f'{country_name} ({country_count})')
-
-'''
-Notes:
-	- Session = (hopefully unique) person/visitor/user
-	- Visit = a length of time where a user interacts with the website. Comes under session, aka a user can have many visits
-	- View = when a page is viewed. Comes under visit, so in one visit, a page can be viewed multiple times
-'''
-
-
-
-# Show initial data
-total_user_sessions = len(user_we_events['session_id'].unique())
-visits_df = user_we_events[['session_id', 'visit_id']].drop_duplicates()
-total_user_visits = len(visits_df)
-total_user_views = len(user_we_events[user_we_events['event_type'] == 1])
-earlist_record = min(ed_df['created_at'].min(), sd_df['created_at'].min(), we_df['created_at'].min())
-earlist_used_record = min(valid_ed_events['created_at'].min(), user_sessions['created_at'].min(), user_we_events['created_at'].min())
-latest_record = min(ed_df['created_at'].max(), sd_df['created_at'].max(), we_df['created_at'].max())
-latest_used_record = max(valid_ed_events['created_at'].max(), user_sessions['created_at'].max(), user_we_events['created_at'].max())
-total_records = len(ed_df) + len(sd_df) + len(we_df)
-total_valid_records = len(valid_ed_events) + len(user_sessions) + len(user_we_events)
-write('###')
-write(f'Report generated at {datetime.now(UTC).strftime(UMAMI_TIMESTAMP_FORMAT)}. This report is based on data collected by and exported from Umami analytics. The earliest record in this export is from {earlist_record} while the latest record is from {latest_record}. Detailed Umami analytics (i.e. including events and not just page views) was added for the public on {ANALYTICS_ADDED_TS}, so records from before then are dropped, even though they may have been valid user visits.')
-write('You can find the current public Umami analytics dashboard at <https://cloud.umami.is/share/b0K7JX1ecA9aZJPP>.')
-write('---')
-if not start_bound and not end_bound:
-	write('The data was not filtered by time.')
-else:
-	write(f'The data was filtered by time. Start bound: {f'{start_bound:%B %d, %Y, %H:%M:%S}' if start_bound else '<no start bound>'}. End bound: {f'{end_bound:%B %d, %Y, %H:%M:%S}' if end_bound else '<no end bound>'}.')
-write(f'Processed {total_records} records, removed {total_records - total_valid_records} development/old/invalid events from that.')
-write(f'The following statistics are based on the remaining {total_valid_records} real user events.')
-write(f'From the first record at {earlist_used_record} to the last record at {latest_used_record} in UTC.')
-write('###')
-write()
-write('== Users, visits, and views ==')
-write('Number of unique real people:', total_user_sessions)
-write(f'They come from {times(len(countries), words=['different country', 'different countries'])}: {', '.join(countries)}')
-write('Number of real user page visits:', total_user_visits)
-write('Number of real user page views:', total_user_views)
-write()
-
-
-
-# Count number of repeat visitors
-number_of_users = -1
-repeat_subset = visits_df.copy()
-repeats = []
-
-while len(repeat_subset) != 0:
-	repeat_users_subset = repeat_subset[~repeat_subset.duplicated('session_id', keep=False)]
-	repeat_users_session_ids = repeat_users_subset['session_id']
-	repeat_users_events = user_we_events[user_we_events['session_id'].isin(repeat_users_session_ids)]['event_id'].unique()
-	repeats.append([len(repeat_users_subset), len(repeat_users_events)])
-	
-	repeat_subset = repeat_subset[repeat_subset.duplicated('session_id')]
+DEFAULT_STATS_PATH = os.path.join(script_dir, 'latest_pipeline_stats.json')
+
+def clean_export (export_dir, start_bound=None, end_bound=None, previous=None, keep_state=False, instrumentation=None):
+	# Loads the three exports in export_dir (an export, or a dataset built by dataset.py) and removes developer/old/invalid/spam data (see cleaning_stages), keeping only rows inside the bounds
+	# With previous (an IncrementalState from an older export), only the rows appended to each export CSV since then are read and cleaned, then added to its cleaned frames
+	# With keep_state (or previous), also returns the IncrementalState for the next run; both are only meant for unbounded runs
+	# Returns (user_sessions, user_we_events, valid_ed_events, TableSummary of each raw export table, IncrementalState or None)
+	if instrumentation is None: instrumentation = Instrumentation()
+	if previous:
+		with instrumentation.stage('Check appended rows'):
+			export_files = previous.appended_files(export_dir)
+		if export_files is None:
+			# These exports aren't the previous ones with rows appended (rows changed or removed), so nothing from before can be trusted
+			return clean_export(export_dir, keep_state=True, instrumentation=instrumentation)
+
+	# Session/visit/event UUIDs of the kept rows are dictionary-encoded into int32 codes shared by all three tables; the facts collected from the whole export keep them as strings
+	export_ids = previous.export_ids if previous else ExportIds()
+	source = ExportDataset(export_dir) if is_dataset(export_dir) else UmamiDatabase.open(export_dir) if is_database(export_dir) else None
+	# The facts cleaning needs from the whole export are collected from every row while each table streams in, unless the source has them (a dataset stores them at build time, a database computes them)
+	source_facts = None
+	if source and not previous:
+		with instrumentation.stage('Load facts') as record:
+			source_facts = source.export_facts(cleaning_constants)
+			if source_facts is not None: record['rows_out'] = sum(source_facts.sizes().values())
+	facts = previous.facts if previous else source_facts if source_facts is not None else ExportFacts()
+	def read_table (table, lookback=None, excluded_rows=None):
+		# excluded_rows: SQL condition for rows cleaning always drops, which a database can leave out of its query
+		on_chunk = facts.collector(table) if source_facts is None else None
+		csv_path = export_csv_path(export_dir, table)
+		with instrumentation.stage(f'Load {table}') as record:
+			if source:
+				frame, summary, record['rows_in'] = source.read_table(table, start_bound, end_bound, lookback, on_chunk, export_ids, whole_table_rows(table, facts), excluded_rows)
+				record['rows_out'] = len(frame)
+				return frame, summary
+			if previous:
+				frame, summary = read_export_table(csv_path, table, on_chunk=on_chunk, ids=export_ids, offset=previous.files[table].offset)
+			else:
+				frame, summary = read_export_table(csv_path, table, start_bound, end_bound, lookback=lookback, on_chunk=on_chunk, ids=export_ids)
+			record['rows_in'], record['rows_out'] = summary.rows, len(frame)
+		return frame, summary
+
+	# Load session data (only in-range rows are kept), get developer sessions from the whole export
+	sd_df, sd_summary = read_table('session_data', excluded_rows=DEV_SESSION_ROWS_SQL)
+	# Load website events data (only in-range rows plus the spam lookback), get developer/old visits from the whole export
+	we_df, we_summary = read_table('website_event', lookback=spam_lookback, excluded_rows=DROPPED_EVENT_ROWS_SQL)
+	# Load event data (only in-range rows plus the spam lookback), keep the first notes length update of every (session, length) from the whole export
+	ed_df, ed_summary = read_table('event_data', lookback=spam_lookback, excluded_rows=DROPPED_EVENT_ROWS_SQL)
+	summaries = {'session_data': sd_summary, 'website_event': we_summary, 'event_data': ed_summary}
+
+	if previous:
+		if not previous.precedes(summaries):
+			# Some appended row is older than the rows before it, so it could change how rows that were already cleaned compare in the spam filters
+			return clean_export(export_dir, keep_state=True, instrumentation=instrumentation)
+		summaries = {table: previous.files[table].summary.merge(summary) for table, summary in summaries.items()}
+
+	# Every kept id is known now; renumber the codes and turn the facts collected while streaming into bitmaps
+	earlier_frames = previous.frames if previous else {}
+	with instrumentation.stage('Finalize ids'):
+		export_ids.finalize(sd_df, we_df, ed_df, *earlier_frames.values())
+		context = {
+			'start_bound': start_bound,
+			'export_ids': export_ids,
+			'loaded': {'session_data': sd_df, 'website_event': we_df, 'event_data': ed_df},
+			**facts.masks(export_ids),
+			'event_spam_tail': earlier_frames.get('event_spam_tail'),
+			'view_spam_tail': earlier_frames.get('view_spam_tail'),
+		}
+
+	frames = run_filters(cleaning_stages, {'user_sessions': sd_df, 'user_we_events': we_df, 'valid_ed_events': ed_df}, context, instrumentation)
+	cleaned_frames = frames
+	if previous:
+		# Rows cleaned by earlier runs come first, as they do in the export
+		earlier_cleaned_frames = run_filters(earlier_rows_stages, {name: earlier_frames[name] for name in frames}, context, instrumentation)
+		cleaned_frames = {name: concat_frames([earlier_cleaned_frames[name], frame]) for name, frame in frames.items()}
+	user_sessions, user_we_events, valid_ed_events = cleaned_frames['user_sessions'], cleaned_frames['user_we_events'], cleaned_frames['valid_ed_events']
+
+	state = None
+	added_frames = {**frames, 'event_spam_tail': context['event_spam_tail_updates'], 'view_spam_tail': context['view_spam_tail_updates']}
+	if previous:
+		state = previous.advance(cleaned_frames, added_frames, summaries, export_files)
+	elif keep_state:
+		state = IncrementalState.fresh(export_dir, added_frames, export_ids, facts, summaries, cleaning_constants)
+	return user_sessions, user_we_events, valid_ed_events, summaries, state
+
+def keep_in_bounds (frame, context):
+	keep = np.ones(len(frame), dtype=bool)
+	if context['start_bound']:
+		keep &= (frame['created_at'] > context['start_bound']).to_numpy()
+	if context['end_bound']:
+		keep &= (frame['created_at'] < context['end_bound']).to_numpy()
+	return keep
+
+class AnalyticsData:
+	# The cleaned frames of one export, loaded once; report() windows them to any bounds, so a long-running process can serve many reports from one load
+	# report_series() does the same for many windows at once (e.g. a weekly trend), sorting the frames by time once instead of scanning them per window
+	def __init__ (self, user_sessions, user_we_events, valid_ed_events, summaries, bounds=(None, None), cache_dir=DEFAULT_CACHE_DIR):
+		self.frames = {
+			'user_sessions': user_sessions,
+			'user_we_events': user_we_events,
+			'valid_ed_events': valid_ed_events,
+		}
+		self.summaries = summaries
+		self.bounds = bounds # the bounds the frames were already cut to while loading, if any
+		self.cache_dir = cache_dir
+
+	@classmethod
+	def load (cls, export_dir=DEFAULT_EXPORT_DIR, cache_dir=DEFAULT_CACHE_DIR, incremental=False, bounds=(None, None), instrumentation=None):
+		# Every cleaning step only depends on the whole export, never on the bounds, so with parquet available the cleaned frames are kept unbounded (and cached) and bounds are ignored here
+		# Without parquet there's nowhere to keep cleaned frames, so the bounds are pushed down into the CSV reads instead, and only reports for windows inside those bounds can be made
+		# A dataset (see dataset.py) is partitioned by time, so bounds are always pushed down into it: only partitions that overlap them are read in full
+		if instrumentation is None: instrumentation = Instrumentation()
+		# A database (see database.py) changes under us, so it isn't cached either; bounds, and whatever cleaning always drops, are pushed into its queries
+		if incremental and is_dataset(export_dir):
+			raise ValueError('Incremental runs need an export, not a dataset (a dataset is rebuilt from its exports instead)')
+		if incremental and is_database(export_dir):
+			raise ValueError('Incremental runs need an export, not a database')
+		if has_parquet and incremental:
+			# Only rows newer than the last incremental run are cleaned; falls back to a full run if there's no usable state
+			incremental_state_dir = os.path.join(cache_dir, 'incremental')
+			with instrumentation.stage('Load incremental state'):
+				previous_state = IncrementalState.load(incremental_state_dir, cleaning_constants)
+			user_sessions, user_we_events, valid_ed_events, summaries, incremental_state = clean_export(export_dir, previous=previous_state, keep_state=True, instrumentation=instrumentation)
+			with instrumentation.stage('Save incremental state'):
+				incremental_state.save(incremental_state_dir)
+			return cls(user_sessions, user_we_events, valid_ed_events, summaries, cache_dir=cache_dir)
+		if has_parquet and not (is_dataset(export_dir) and any(bounds)) and not is_database(export_dir):
+			cleaned_cache = CleanedFrameCache(os.path.join(cache_dir, 'cleaned'))
+			with instrumentation.stage('Load cleaned frames from cache') as record:
+				cache_key = cleaned_cache.key(export_input_paths(export_dir), cleaning_constants)
+				cached = cleaned_cache.load(cache_key)
+				record['rows_out'] = sum(map(len, cached[0].values())) if cached else 0
+			if cached:
+				cleaned_frames, cache_meta = cached
+				summaries = {table: TableSummary.from_dict(summary) for table, summary in cache_meta['summaries'].items()}
+				return cls(cleaned_frames['user_sessions'], cleaned_frames['user_we_events'], cleaned_frames['valid_ed_events'], summaries, cache_dir=cache_dir)
+			user_sessions, user_we_events, valid_ed_events, summaries, _ = clean_export(export_dir, instrumentation=instrumentation)
+			with instrumentation.stage('Store cleaned frames in cache'):
+				cleaned_cache.store(cache_key, {'user_sessions': user_sessions, 'user_we_events': user_we_events, 'valid_ed_events': valid_ed_events}, {'summaries': {table: summary.to_dict() for table, summary in summaries.items()}})
+			return cls(user_sessions, user_we_events, valid_ed_events, summaries, cache_dir=cache_dir)
+		user_sessions, user_we_events, valid_ed_events, summaries, _ = clean_export(export_dir, *bounds, instrumentation=instrumentation)
+		return cls(user_sessions, user_we_events, valid_ed_events, summaries, bounds=bounds, cache_dir=cache_dir)
+
+	def check_covers (self, start_bound, end_bound):
+		# Cleaning commutes with windowing, so frames cut to some bounds while loading still give exact reports for any window inside them
+		loaded_start, loaded_end = self.bounds
+		if (loaded_start and (not start_bound or start_bound < loaded_start)) or (loaded_end and (not end_bound or end_bound > loaded_end)):
+			raise ValueError(f'These frames were cut to {self.bounds} while loading (no parquet support), so they can\'t be windowed to {(start_bound, end_bound)}')
+
+	def window (self, start_bound=None, end_bound=None, instrumentation=None):
+		if instrumentation is None: instrumentation = Instrumentation()
+		self.check_covers(start_bound, end_bound)
+		frames = run_filters([FilterStage('Time bounds', list(self.frames), keep_in_bounds)], dict(self.frames), {'start_bound': start_bound, 'end_bound': end_bound}, instrumentation)
+		return self.report_window(frames, start_bound, end_bound)
+
+	def report_window (self, frames, start_bound, end_bound):
+		return self.window_factory()(frames, start_bound=start_bound, end_bound=end_bound)
+
+	def window_factory (self):
+		# Picklable stand-in for report_window(), for worker processes that have their own copy of the frames
+		return functools.partial(ReportWindow, summaries=self.summaries, country_names_memo_path=os.path.join(self.cache_dir, 'country_names.json'))
+
+	def last_record (self):
+		# Latest created_at left after cleaning, e.g. to know where an open-ended period stops
+		return max(frame['created_at'].max() for frame in self.frames.values())
+
+	def report (self, start_bound=None, end_bound=None, sections=None, instrumentation=None, workers=1):
+		# Returns {section name: results} for the rows inside the bounds; see render_text() and render_json()
+		# With workers > 1 (and pyarrow), sections run in that many processes; results are the same either way
+		if instrumentation is None: instrumentation = Instrumentation()
+		if workers > 1 and has_parquet:
+			self.check_covers(start_bound, end_bound)
+			return compute_sections_parallel(report_sections if sections is None else sections, self.frames, [(start_bound, end_bound)], self.window_factory(), instrumentation, workers)[0]
+		return compute_sections(report_sections if sections is None else sections, self.window(start_bound, end_bound, instrumentation), instrumentation)
+
+	def report_series (self, windows, sections=None, instrumentation=None, workers=1):
+		# Returns [(start_bound, end_bound, {section name: results})] for every (start_bound, end_bound) in windows, in that order; see render_text_series() and render_json_series()
+		# Each window's results are the same as report() with its bounds; windows may overlap or leave gaps
+		# With workers > 1 (and pyarrow), every (window, section) pair is its own task in a pool of that many processes
+		if instrumentation is None: instrumentation = Instrumentation()
+		for start_bound, end_bound in windows:
+			self.check_covers(start_bound, end_bound)
+		if workers > 1 and has_parquet:
+			labels = [format_window(start_bound, end_bound) for start_bound, end_bound in windows]
+			results = compute_sections_parallel(report_sections if sections is None else sections, self.frames, windows, self.window_factory(), instrumentation, workers, labels=labels)
+			return [(start_bound, end_bound, window_results) for (start_bound, end_bound), window_results in zip(windows, results)]
+		with instrumentation.stage('Window index', rows_in=sum(map(len, self.frames.values()))):
+			window_index = WindowIndex(self.frames)
+		series = []
+		for start_bound, end_bound in windows:
+			with instrumentation.stage(f'Time bounds ({format_window(start_bound, end_bound)})') as record:
+				frames = window_index.rows(start_bound, end_bound)
+				record['rows_out'] = sum(map(len, frames.values()))
+			window = self.report_window(frames, start_bound, end_bound)
+			series.append((start_bound, end_bound, compute_sections(report_sections if sections is None else sections, window, instrumentation, label=format_window(start_bound, end_bound))))
+		return series
 
-repeat_count = 1
-write('== Repeat visitors ==')
-for user_count, event_count in repeats:
-	write(f'{times(user_count, words=['person', 'people'])} visited exactly {times(repeat_count)}. Total: {times(event_count, words='event')}. Avg. per user: {times(round(event_count / user_count, 1), words='event') if (user_count > 0) else 'n/a'}.')
-	repeat_count += 1
-write('Note that events here includes page views and so will be higher than the events in the events overview/in detail below.')
-write()
-
-
-
-# Check what kinds of devices are used
-write('== Devices used ==')
-devices_by_session_id = user_we_events.groupby('session_id')['device'].unique()
-for device, count in devices_by_session_id.explode().value_counts().items():
-	write(f'{times(count, words=['user is', 'users are'])} using a {device}.')
-write(f'Note that one user can use multiple devices, so total may not add to {total_user_sessions} (total # of users).')
-write()
-
-
-
-# Check where they came from
-write('== Visitor referrals ==')
-referrer_map = {
-	'siege.hackclub.com': 'Siege (via Hack Club)',
-	'com.slack': 'Slack App',
-	'l.instagram.com': 'Instagram',
-	'm.facebook.com': 'Facebook',
-	'google.com': 'Google',
-	'github.com': 'GitHub',
-	'facebook.com': 'Facebook',
-	'instagram.com': 'Instagram',
-	'com.google.android.googlequicksearchbox': 'Android Google Search (System Package)',
-	'classroom.google.com': 'Google Classroom',
-}
-number_of_users_by_referrer = user_we_events.groupby('visit_id')['referrer_domain'].unique().explode().value_counts(dropna=False).items()
-number_by_referrer_combined = {}
-
-for referrer, count in number_of_users_by_referrer:
-	if pd.isna(referrer):
-		number_by_referrer_combined[''] = count
-	else:
-		referrer_name = referrer_map.get(referrer, referrer)
-		number_by_referrer_combined[referrer_name] = number_by_referrer_combined.get(referrer_name, 0) + count
-
-for referrer_name, count in number_by_referrer_combined.items():
-	if referrer_name == '':
-		write(f'{times(count, words='user')} visited TC22 directly (not referred).')
+# Check uniqueness (dev)
+def print_visits_with_multiple_sessions (export_dir=DEFAULT_EXPORT_DIR):
+	# only for developers! every visit is expected to belong to exactly one session
+	col_a = 'visit_id'
+	col_b = 'session_id'
+	we_df, _ = read_export_table(export_csv_path(export_dir, 'website_event'), 'website_event')
+	df = we_df[['session_id', 'visit_id']]
+	unique_counts = df.groupby(col_a)[col_b].nunique()
+	those_with_multiple = unique_counts[unique_counts > 1]
+
+	list_of_multiple = those_with_multiple.index.tolist()
+	print(f'[{col_a}]s with multiple [{col_b}]s: {list_of_multiple} ({col_a})')
+	for item in list_of_multiple:
+		print(f'{col_a} == {item}:\n', df[df[col_a] == item])
+		print(f'Associated {col_b} values:', df[df[col_a] == item][col_b].unique())
+
+
+
+# Command line interface
+def parse_bound (text):
+	# 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' (UTC, like Umami's own timestamps)
+	for bound_format in ('%Y-%m-%d', UMAMI_TIMESTAMP_FORMAT):
+		try: return datetime.strptime(text, bound_format)
+		except ValueError: pass
+	raise ValueError(f'Invalid bound {text!r}, expected YYYY-MM-DD or YYYY-MM-DD HH:MM:SS')
+
+def bound_argument (text):
+	if not text: return None
+	try: return parse_bound(text)
+	except ValueError as error: raise argparse.ArgumentTypeError(str(error))
+
+def period_argument (text):
+	try: return parse_period(text, parse_bound)
+	except ValueError as error: raise argparse.ArgumentTypeError(str(error))
+
+def parse_arguments (argv=None):
+	parser = argparse.ArgumentParser(description='Builds the TC22 analytics report from an Umami data export.')
+	parser.add_argument('export_dir', nargs='?', default=DEFAULT_EXPORT_DIR, help='directory with the exported session_data.csv, website_event.csv and event_data.csv, or a dataset built by python -m analytics.dataset, or a database URL (sqlite:///path or postgresql://...) with those tables')
+	parser.add_argument('--start', type=bound_argument, help='only use records after this time (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS, UTC)')
+	parser.add_argument('--end', type=bound_argument, help='only use records before this time (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS, UTC)')
+	windows = parser.add_mutually_exclusive_group()
+	windows.add_argument('--window', nargs=2, action='append', type=bound_argument, metavar=('START', 'END'), help='batch mode: also report on this window (repeatable); each window gives the same report as --start START --end END')
+	windows.add_argument('--period', type=period_argument, help='batch mode: report on consecutive windows, e.g. "weekly since 2025-12-13" or "monthly since 2025-12-01 until 2026-03-01" (daily/weekly/monthly)')
+	parser.add_argument('--format', choices=list(report_renderers), default='text', help='report format (default: text)')
+	parser.add_argument('--output', help='report file (default: latest_analytics_report.txt/.json, or latest_analytics_series.txt/.json in batch mode, next to this script)')
+	parser.add_argument('--incremental', action='store_true', help='only process rows added since the last incremental run')
+	parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where cleaned frames, incremental state and country names are kept')
+	parser.add_argument('--stats', default=DEFAULT_STATS_PATH, help='pipeline stage stats file (JSON)')
+	parser.add_argument('--trace-memory', action='store_true', help='record per-stage peak memory via tracemalloc; accurate, but makes cleaning a lot slower')
+	parser.add_argument('--backend', choices=['pandas', 'duckdb'], default='pandas', help='pandas (default) keeps the cleaned frames in memory; duckdb cleans and aggregates in an on-disk DuckDB database that spills past memory (needs duckdb, no --incremental)')
+	parser.add_argument('--workers', type=int, default=1, help='compute report sections (and batch windows) in this many processes (default: 1, needs pyarrow)')
+	parser.add_argument('--quiet', action='store_true', help="don't print the report and stage stats")
+	parser.add_argument('--check-visit-sessions', action='store_true', help='developer check: list visits that belong to more than one session, then exit')
+	args = parser.parse_args(argv)
+	if (args.window or args.period) and (args.start or args.end):
+		parser.error('--start/--end can\'t be combined with --window/--period')
+	if args.backend == 'duckdb' and args.incremental:
+		parser.error('--incremental is only supported by the pandas backend')
+	if args.incremental and (is_dataset(args.export_dir) or is_database(args.export_dir)):
+		parser.error('--incremental needs an export, not a dataset or database')
+	if args.backend == 'duckdb' and is_database(args.export_dir):
+		parser.error('The duckdb backend reads exports and datasets, not databases')
+	return args
+
+def main (argv=None):
+	args = parse_arguments(argv)
+	if args.check_visit_sessions:
+		print_visits_with_multiple_sessions(args.export_dir)
+		return
+
+	instrumentation = Instrumentation(trace_memory=args.trace_memory)
+	if args.backend == 'duckdb':
+		from .duckdb_backend import DuckDBAnalyticsData as data_class
 	else:
-		write(f'{times(count, words='user')} reached TC22 via {referrer_name}.')
-
-write('Note that one user can use visit multiple times, so total may not add to', total_user_sessions, '(total # of users).')
-write()
-
-
-
-# Events overview
-event_names_by_session_id = valid_ed_events.drop_duplicates('event_id').groupby('session_id')['event_name'].count()
-event_names_by_session_id = pd.concat([event_names_by_session_id, pd.Series([0] * (total_user_sessions - len(event_names_by_session_id)))]) # Fill with 0-event users until proper number of users achieved
-avg_events_per_user = round(event_names_by_session_id.mean(), 2)
-percentile_of_avg_events = round(stats.percentileofscore(event_names_by_session_id, event_names_by_session_id.mean()), 2)
-quantile_values = event_names_by_session_id.quantile([0.25, 0.5, 0.75]).tolist()
-write('== Events overview ==')
-write(f'There are {total_user_sessions} users, and on average, each user does about {avg_events_per_user} events. This is more than {percentile_of_avg_events}% of users. 75% of users have at least {quantile_values[0]} events, 50% of users have at least {quantile_values[1]} events, and 25% of users have at least {quantile_values[2]} events. The user with the most events has {event_names_by_session_id.max()} events.')
-event_count_ranges = ((0, 1), (2, 5), (6, 10), (11, 20), (21, 30), (31, 40), (41, 50), (51, 999))
-for event_count_range in event_count_ranges:
-	users_in_range_count = len(event_names_by_session_id[(
-		(event_names_by_session_id >= event_count_range[0]) &
-		(event_names_by_session_id <= event_count_range[1])
-	)])
-	single = (event_count_range[0] == event_count_range[1])
-	write(f'{times(users_in_range_count, words='user')} have {event_count_range[0] if single else (f'between {event_count_range[0]} and {event_count_range[1]}')} {'event' if (single and (event_count_range[0] == 1)) else 'events'}.')
-write()
-
-# Events in detail
-write('== Events in detail ==')
-events_map = valid_ed_events.drop_duplicates('event_id')['event_name'].value_counts().items()
-event_name_map = {
-	'sidebar-page-navigated': 'Users went to a sidebar page',
-	'sidebar-toggled': 'Users toggled the sidebar',
-	'simulated-fullscreen-entered': 'Users entered the simulated fullscreen mode',
-	'simulated-fullscreen-exited': 'Users exited the simulated fullscreen mode',
-	'school-selected': 'Users picked their school',
-	'school-name-clicked': 'Users clicked the school name in the bottom middle',
-	'notes-toggled': 'Users toggled the notes widget',
-	'setting-changed': 'Users changed their settings',
-	'toggle-fullscreen-clicked': 'Users toggled fullscreen',
-	'timer-toggled': 'Users toggled the timer widget',
-	'get-pwa-clicked': 'Users clicked the "Get app" button',
-	'stopwatch-toggled': 'Users toggled the stopwatch widget',
-	'notes-updated': 'Users edited their notes',
-	'timer-used': 'Users interacted with the timer widget',
-	'stopwatch-used': 'Users interacted with the stopwatch widget',
-	'division-selected': 'Users picked their division',
-}
-schools_map = {
-	-2: 'Always High School',
-	-1: 'None',
-	1: 'Chino Hills High School',
-	2: 'Cal Aero Preserve Academy JH',
-	3: 'Ayala High School',
-	4: 'Ruth Fox Middle School',
-}
-
-def get_event_nkv_mask (name, key, values):
-	if isinstance(values, str):
-		values = {values}
-	return (
-		(valid_ed_events['event_name'] == name) &
-		(valid_ed_events['data_key'] == key) &
-		(valid_ed_events['string_value'].isin(values))
-	)
-
-def get_unique_events_by_nkv (name, key, values):
-	return valid_ed_events[get_event_nkv_mask(name, key, values)].drop_duplicates('event_id')
-
-def top_n_values (name, key, n):
-	settings_changed = valid_ed_events[(
-		(valid_ed_events['event_name'] == name) &
-		(valid_ed_events['data_key'] == key)
-	)]['string_value'].value_counts().items()
-	total = 0
-	result = []
-	for setting, count in settings_changed:
-		result.append([setting, count])
-		total += 1
-		if total >= n: break
-	return [total, result]
-
-def format_top_string_values (result):
-	if len(result) == 0: return '(none)'
-	if len(result) > 1: result[-1][0] = 'and ' + result[-1][0]
-	return (', ' if len(result) > 2 else ' ').join(map(lambda combined: f'{combined[0]} ({combined[1]})', result))
-
-def get_auxiliary_event_info (event_name):
-	info = ''
-	
-	if 0: pass # it looks nicer when the other ones are all 'elif' :]
-	# By the way, I've commented events because the information isn't that useful to know. I'd rather a cleaner output with useful information that a messy one with all the information.
-	elif event_name == 'setting-changed':
-		total, setting_counts = top_n_values(event_name, 'setting', 5)
-		info = f'The top {times(total, words='setting')} changed were {format_top_string_values(setting_counts)}.'
-	elif event_name == 'school-selected':
-		total, school_counts = top_n_values(event_name, 'schoolId', 3)
-		school_counts = [[schools_map.get(int(schoolId), 'School ID ' + schoolId), count] for schoolId, count in school_counts]
-		info = f'The top {times(total, words='school')} selected were {format_top_string_values(school_counts)}.'
-	elif event_name == 'sidebar-page-navigated':
-		total, page_counts = top_n_values(event_name, 'page', 5)
-		info = f'The top {times(total, words='page')} navigated to were {format_top_string_values(page_counts)}.'
-	elif event_name == 'school-name-clicked':
-		no_school_count = len(get_unique_events_by_nkv(event_name, 'alreadySelected', 'false'))
-		already_school_count = len(get_unique_events_by_nkv(event_name, 'alreadySelected', 'true'))
-		info = f'This was {times(no_school_count, words=["user's", "users'"])} first school selected and {times(already_school_count, words='user')} already had a school selected.'
-	elif event_name == 'simulated-fullscreen-entered':
-		total, element_counts = top_n_values(event_name, 'id', 3)
-		info = f'The top {times(total, words='element')} entered were {format_top_string_values(element_counts)}.'
-	# elif event_name == 'simulated-fullscreen-exited':
-	# 	total, element_counts = top_n_values(event_name, 'id', 3)
-	# 	info = f'The top {times(total, words='element')} exited were {format_top_string_values(element_counts)}.'
-	elif event_name == 'division-selected':
-		division_total, division_counts = top_n_values(event_name, 'divisionLabel', 3)
-		info = f'The top {times(division_total, words=['division was', 'divisions were'])} {format_top_string_values(division_counts)}.'
-	elif event_name == 'get-pwa-clicked':
-		no_school_count = len(get_unique_events_by_nkv(event_name, 'outcome', 'dismissed'))
-		already_school_count = len(get_unique_events_by_nkv(event_name, 'outcome', 'accepted'))
-		info = f'The app download was accepted {times(already_school_count)} and dismissed {times(no_school_count)}.'
-	elif event_name == 'notes-updated':
-		longest_note_length = float(valid_ed_events[(
-			(valid_ed_events['event_name'] == event_name) &
-			(valid_ed_events['data_key'] == 'length')
-		)]['string_value'].max())
-		info = f'The longest note was {times(longest_note_length, words='character')}.'
-	# elif event_name in {'stopwatch-toggled', 'timer-toggled', 'notes-toggled'}:
-	# 	opened_count = len(get_unique_events_by_nkv(event_name, 'newState', 'open'))
-	# 	closed_count = len(get_unique_events_by_nkv(event_name, 'newState', 'closed'))
-	# 	info = f'It was opened {times(opened_count)} and closed {times(closed_count)}.'
-	# elif event_name == 'sidebar-toggled':
-	# 	opened_count = len(get_unique_events_by_nkv(event_name, 'isOpenNow', 'true'))
-	# 	closed_count = len(get_unique_events_by_nkv(event_name, 'isOpenNow', 'false'))
-	# 	info = f'It was toggled open {times(closed_count)} and closed {times(opened_count)}.'
-	elif event_name == 'toggle-fullscreen-clicked':
-		entered_count = len(get_unique_events_by_nkv(event_name, 'attemptedNewState', 'fullscreen'))
-		exited_count = len(get_unique_events_by_nkv(event_name, 'attemptedNewState', 'no-fullscreen'))
-		info = f'They entered fullscreen {times(entered_count)} and exited fullscreen {times(exited_count)}.'
-	elif event_name == 'stopwatch-used':
-		started_count = len(get_unique_events_by_nkv(event_name, 'event', 'start'))
-		stopped_count = len(get_unique_events_by_nkv(event_name, 'event', 'stop'))
-		resetted_count = len(get_unique_events_by_nkv(event_name, 'event', 'reset'))
-		info = f'They started it {times(started_count)}, stopped it {times(stopped_count)}, and reset it {times(resetted_count)}.'
-	elif event_name == 'timer-used':
-		started_count = len(get_unique_events_by_nkv(event_name, 'event', 'start'))
-		stopped_count = len(get_unique_events_by_nkv(event_name, 'event', 'stop'))
-		muted_count = len(get_unique_events_by_nkv(event_name, 'event', 'mute'))
-		unmuted_count = len(get_unique_events_by_nkv(event_name, 'event', 'unmute'))
-		resetted_count = len(get_unique_events_by_nkv(event_name, 'event', 'reset'))
-		info = f'They started it {times(started_count)}, stopped it {times(stopped_count)}, muted it {times(muted_count)}, unmuted it {times(unmuted_count)}, and reset it {times(resetted_count)}.'
-	
-	return info
-
-for event_name, count in events_map:
-	event_description = event_name_map.get(event_name)
-	auxiliary_info = get_auxiliary_event_info(event_name)
-	auxiliary_info = (' ' + auxiliary_info) if auxiliary_info else ''
-	if event_description:
-		write(f'{event_description} {times(count)}.{auxiliary_info}')
+		data_class = AnalyticsData
+	if args.window or args.period:
+		# Batch mode: one load, then every window is cut from the same cleaned frames
+		if args.window:
+			windows = [tuple(window) for window in args.window]
+			bounds = (None if any(start is None for start, _ in windows) else min(start for start, _ in windows), None if any(end is None for _, end in windows) else max(end for _, end in windows))
+		else:
+			period_length, since, until = args.period
+			bounds = (since, until)
+		data = data_class.load(args.export_dir, args.cache_dir, incremental=args.incremental, bounds=bounds, instrumentation=instrumentation)
+		if args.period:
+			windows = period_windows(period_length, since, until, data.last_record())
+		report = series_renderers[args.format](data.report_series(windows, instrumentation=instrumentation, workers=args.workers))
+		report_name = 'latest_analytics_series'
 	else:
-		write(f'The {event_name} event happened {times(count)}.{auxiliary_info}')
-write()
-
+		bounds = (args.start, args.end)
+		data = data_class.load(args.export_dir, args.cache_dir, incremental=args.incremental, bounds=bounds, instrumentation=instrumentation)
+		report = report_renderers[args.format](data.report(*bounds, instrumentation=instrumentation, workers=args.workers))
+		report_name = 'latest_analytics_report'
+
+	# Write to analytics report file
+	output_path = args.output or os.path.join(script_dir, f'{report_name}.{'txt' if args.format == 'text' else args.format}')
+	with open(output_path, 'w') as report_file:
+		report_file.write(report)
+
+	# Write pipeline stage stats next to the report
+	if not args.quiet:
+		print(report, end='')
+		print()
+		print('\n'.join(instrumentation.lines()))
+	instrumentation.write_json(args.stats)
 
-
-# Write to analytics report file
-write('End of report')
-write('###')
-with open(analytics_report_file_path, 'w') as report_file:
-	report_file.writelines(lines_to_write)
-
-
-
-# Check uniqueness (dev)
-exit(0) # only for developers!
-col_a = 'visit_id'
-col_b = 'session_id'
-df = we_df[['session_id', 'visit_id']]
-unique_counts = df.groupby(col_a)[col_b].nunique()
-those_with_multiple = unique_counts[unique_counts > 1]
-
-list_of_multiple = those_with_multiple.index.tolist()
-print(f'[{col_a}]s with multiple [{col_b}]s: {list_of_multiple} ({col_a})')
-for item in list_of_multiple:
-	print(f'{col_a} == {item}:\n', df[df[col_a] == item])
-	print(f'Associated {col_b} values:', df[df[col_a] == item][col_b].unique())
+if __name__ == '__main__':
+	main()
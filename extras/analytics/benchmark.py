@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from .analyze import DEFAULT_CACHE_DIR, script_dir
+from .generate_export import generate_export
+from .pipeline import Instrumentation, format_mib
+
+# Benchmarks the report (python -m analytics) on synthetic exports of a few sizes
+# Every run is a separate `python -m analytics --stats ...` process, so timings include imports and peak RSS isn't inflated by earlier runs; per-stage and per-section times come from its stage stats
+DEFAULT_ROWS = [10000, 100000, 1000000]
+DEFAULT_BENCHMARK_DIR = os.path.join(DEFAULT_CACHE_DIR, 'benchmarks')
+DEFAULT_RESULTS_PATH = os.path.join(script_dir, 'latest_benchmark.json')
+COMPLETE_MARKER = '.complete'
+
+# name -> (report arguments, whether it starts from an empty cache); runs in this order, so later scenarios find the cache the cold run filled
+SCENARIOS = {
+	'cold': ([], True),
+	'warm': ([], False),
+	'weekly': (['--period', 'weekly since 2025-12-13'], False),
+}
+
+def synthetic_export (benchmark_dir, rows, seed):
+	# Generated once per (rows, seed) and kept, since big exports take a while to write
+	export_dir = os.path.join(benchmark_dir, 'exports', f'rows-{rows}-seed-{seed}')
+	if not os.path.exists(os.path.join(export_dir, COMPLETE_MARKER)):
+		shutil.rmtree(export_dir, ignore_errors=True)
+		generate_export(export_dir, rows, seed)
+		open(os.path.join(export_dir, COMPLETE_MARKER), 'w').close()
+	return export_dir
+
+def run_scenario (export_dir, cache_dir, arguments, workers, backend='pandas'):
+	# Returns (wall seconds, stage records)
+	with tempfile.TemporaryDirectory(prefix='analytics-benchmark-') as run_dir:
+		stats_path = os.path.join(run_dir, 'stats.json')
+		command = [sys.executable, '-m', __package__, export_dir, '--quiet', '--cache-dir', cache_dir, '--stats', stats_path, '--output', os.path.join(run_dir, 'report'), '--workers', str(workers), '--backend', backend, *arguments]
+		started = time.perf_counter()
+		# The package has to be importable from wherever this was started
+		python_path = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(script_dir)), os.environ.get('PYTHONPATH')]))
+		subprocess.run(command, check=True, env={**os.environ, 'PYTHONPATH': python_path})
+		wall_seconds = time.perf_counter() - started
+		with open(stats_path) as stats_file:
+			return round(wall_seconds, 6), json.load(stats_file)['stages']
+
+def peak_rss_bytes (stages):
+	rss = [stage['max_rss_bytes'] for stage in stages if stage['max_rss_bytes'] is not None]
+	return max(rss) if rss else None
+
+def run_benchmarks (row_counts, seed=0, workers=1, benchmark_dir=DEFAULT_BENCHMARK_DIR, scenarios=SCENARIOS, backend='pandas'):
+	results = []
+	for rows in row_counts:
+		export_dir = synthetic_export(benchmark_dir, rows, seed)
+		cache_dir = tempfile.mkdtemp(prefix='analytics-benchmark-cache-')
+		try:
+			for scenario, (arguments, cold) in scenarios.items():
+				if cold:
+					shutil.rmtree(cache_dir, ignore_errors=True)
+				wall_seconds, stages = run_scenario(export_dir, cache_dir, arguments, workers, backend)
+				results.append({'rows': rows, 'scenario': scenario, 'backend': backend, 'workers': workers, 'wall_seconds': wall_seconds, 'peak_rss_bytes': peak_rss_bytes(stages), 'stages': stages})
+		finally:
+			shutil.rmtree(cache_dir, ignore_errors=True)
+	return results
+
+def result_lines (result, baseline=None):
+	lines = [f'== {result['rows']} rows, {result['scenario']}, {result.get('backend', 'pandas')} backend ({result['workers']} {'process' if result['workers'] == 1 else 'processes'}) ==']
+	summary = f'Wall time: {result['wall_seconds']:.3f} s, peak RSS: {format_mib(result['peak_rss_bytes'])} MiB'
+	if baseline:
+		summary += f' (baseline: {baseline['wall_seconds']:.3f} s, {format_mib(baseline['peak_rss_bytes'])} MiB; {result['wall_seconds'] / baseline['wall_seconds']:.2f}x time)'
+	lines.append(summary)
+	instrumentation = Instrumentation()
+	instrumentation.stages = result['stages']
+	lines.extend(instrumentation.lines())
+	return lines
+
+def main (argv=None):
+	parser = argparse.ArgumentParser(description='Benchmarks the analytics report on synthetic Umami exports.')
+	parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help=f'export sizes, in total rows (default: {' '.join(map(str, DEFAULT_ROWS))})')
+	parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic exports (default: 0)')
+	parser.add_argument('--workers', type=int, default=1, help='passed on to the report (default: 1)')
+	parser.add_argument('--backend', choices=['pandas', 'duckdb'], default='pandas', help='passed on to the report (default: pandas)')
+	parser.add_argument('--scenario', choices=list(SCENARIOS), action='append', help='only run these scenarios (repeatable; default: all); warm/weekly without cold measure whatever the cache has')
+	parser.add_argument('--benchmark-dir', default=DEFAULT_BENCHMARK_DIR, help='where generated exports are kept between runs')
+	parser.add_argument('--output', default=DEFAULT_RESULTS_PATH, help='results file (JSON)')
+	parser.add_argument('--baseline', help='earlier results file to compare wall time and peak RSS against')
+	args = parser.parse_args(argv)
+
+	scenarios = {name: SCENARIOS[name] for name in SCENARIOS if not args.scenario or name in args.scenario}
+	results = run_benchmarks(args.rows, args.seed, args.workers, args.benchmark_dir, scenarios, args.backend)
+	baselines = {}
+	if args.baseline:
+		with open(args.baseline) as baseline_file:
+			baselines = {(result['rows'], result['scenario'], result.get('backend', 'pandas'), result['workers']): result for result in json.load(baseline_file)['results']}
+	for result in results:
+		print('\n'.join(result_lines(result, baselines.get((result['rows'], result['scenario'], result['backend'], result['workers'])))))
+		print()
+	with open(args.output, 'w') as results_file:
+		json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'seed': args.seed, 'results': results}, results_file, indent='\t')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import pandas as pd
+
+# Parquet needs pyarrow; without it there's simply no cache and everything is recomputed from the CSVs
+# The one check for pyarrow: datasets, incremental state and the frames shared with worker processes need it too
+try:
+	import pyarrow
+	has_parquet = True
+except ImportError:
+	has_parquet = False
+
+# Cleaned frames, incremental state and country names go here unless told otherwise
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '.cache')
+CACHE_FORMAT_VERSION = 1
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024 ** 3
+HASH_BLOCK_BYTES = 1024 * 1024
+DIGESTS_FILE_NAME = 'file_digests.json'
+META_FILE_NAME = 'meta.json'
+
+def directory_size (path):
+	total = 0
+	for root, dirs, files in os.walk(path):
+		for file_name in files:
+			total += os.path.getsize(os.path.join(root, file_name))
+	return total
+
+class CleanedFrameCache:
+	# On-disk cache of cleaned frames, one directory of parquet files per key
+	# The key is a hash of the input files' contents plus whatever constants the cleaning depends on, so changing either one invalidates old entries
+	def __init__ (self, cache_dir, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		os.makedirs(cache_dir, exist_ok=True)
+		self.digests_path = os.path.join(cache_dir, DIGESTS_FILE_NAME)
+
+	def file_digest (self, path):
+		# Hashing a big export takes a while, so digests are remembered per (path, size, mtime) and only recomputed when the file changes
+		stat = os.stat(path)
+		stamp = f'{stat.st_size}:{stat.st_mtime_ns}'
+		digests = self.read_digests()
+		remembered = digests.get(os.path.abspath(path))
+		if isinstance(remembered, dict) and remembered.get('stamp') == stamp:
+			return remembered['digest']
+		hasher = hashlib.sha256()
+		with open(path, 'rb') as input_file:
+			while block := input_file.read(HASH_BLOCK_BYTES):
+				hasher.update(block)
+		digests[os.path.abspath(path)] = {'stamp': stamp, 'digest': hasher.hexdigest()}
+		self.write_digests(digests)
+		return hasher.hexdigest()
+
+	def read_digests (self):
+		# A missing or unreadable file (e.g. one a crashed run cut short) only means digests get recomputed
+		try:
+			with open(self.digests_path) as digests_file:
+				digests = json.load(digests_file)
+		except (OSError, ValueError):
+			return {}
+		return digests if isinstance(digests, dict) else {}
+
+	def write_digests (self, digests):
+		# Written to a temporary file first, since reports can run concurrently; files that no longer exist are dropped
+		digests = {path: digest for path, digest in digests.items() if os.path.exists(path)}
+		temp_path = self.digests_path + f'.tmp-{os.getpid()}'
+		with open(temp_path, 'w') as digests_file:
+			json.dump(digests, digests_file)
+		os.replace(temp_path, self.digests_path)
+
+	def key (self, input_paths, constants):
+		hasher = hashlib.sha256()
+		hasher.update(str(CACHE_FORMAT_VERSION).encode())
+		for path in input_paths:
+			hasher.update(self.file_digest(path).encode())
+		hasher.update(json.dumps(constants, sort_keys=True, default=str).encode())
+		return hasher.hexdigest()[:32]
+
+	def entry_dir (self, key):
+		return os.path.join(self.cache_dir, key)
+
+	def load (self, key):
+		# Returns (frames by name, meta) or None on a miss
+		entry_dir = self.entry_dir(key)
+		meta_path = os.path.join(entry_dir, META_FILE_NAME)
+		if not os.path.exists(meta_path): return None
+		try:
+			with open(meta_path) as meta_file:
+				meta = json.load(meta_file)
+			frames = {name: pd.read_parquet(os.path.join(entry_dir, name + '.parquet')) for name in meta['frames']}
+		except (OSError, ValueError, KeyError):
+			shutil.rmtree(entry_dir, ignore_errors=True)
+			return None
+		os.utime(meta_path) # recently used entries are evicted last
+		return frames, meta
+
+	def store (self, key, frames, meta):
+		# Written to a temporary directory first so a crash never leaves a half-written entry behind
+		entry_dir = self.entry_dir(key)
+		temp_dir = entry_dir + f'.tmp-{os.getpid()}'
+		shutil.rmtree(temp_dir, ignore_errors=True)
+		os.makedirs(temp_dir)
+		for name, frame in frames.items():
+			frame.reset_index(drop=True).to_parquet(os.path.join(temp_dir, name + '.parquet'), index=False)
+		meta = dict(meta, frames=list(frames), created_at=time.time())
+		with open(os.path.join(temp_dir, META_FILE_NAME), 'w') as meta_file:
+			json.dump(meta, meta_file, default=str)
+		shutil.rmtree(entry_dir, ignore_errors=True)
+		os.replace(temp_dir, entry_dir)
+		self.evict(keep=key)
+
+	def evict (self, keep=None):
+		# Drops least recently used entries until the cache fits in max_bytes
+		entries = []
+		for name in os.listdir(self.cache_dir):
+			meta_path = os.path.join(self.cache_dir, name, META_FILE_NAME)
+			if os.path.exists(meta_path):
+				entries.append([os.path.getmtime(meta_path), name, directory_size(os.path.join(self.cache_dir, name))])
+		total = sum(size for _, _, size in entries)
+		for _, name, size in sorted(entries):
+			if total <= self.max_bytes: break
+			if name == keep: continue
+			shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+			total -= size
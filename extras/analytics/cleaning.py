@@ -0,0 +1,212 @@
+import hashlib
+import itertools
+import json
+import numpy as np
+import pandas as pd
+from .ingest import UMAMI_TIMESTAMP_FORMAT
+from .pipeline import FilterStage
+from .spam import find_spam
+
+# What counts as developer/old/invalid/spam data, and the rules that remove it (see analyze.clean_export())
+
+# analytics events were added in commit e2eebadce74aefe153aef4a71d7b4bf931cc5861, although theoretically older visits COULD still be valid
+ANALYTICS_ADDED_TS = '2025-12-13 09:30:00'
+# old notes-updated events fired too much before a bugfix was committed (de24e77862d4dcc3c2a3340fdb6dabb60e06cacc)
+NOTES_UPDATED_OVERFIRE_FIXED_TS = '2025-12-31 12:15'
+event_spam_threshold = pd.Timedelta(seconds=1)
+view_spam_threshold = pd.Timedelta(seconds=10)
+# The spam filters compare each row with the previous one in its group, so rows slightly before the start bound are still loaded for them
+spam_lookback = max(event_spam_threshold, view_spam_threshold)
+
+# Bump this whenever the cleaning below changes in a way the constants above don't capture, so cached cleaned frames get invalidated
+CLEANING_VERSION = 2
+cleaning_constants = {
+	'CLEANING_VERSION': CLEANING_VERSION,
+	'ANALYTICS_ADDED_TS': ANALYTICS_ADDED_TS,
+	'NOTES_UPDATED_OVERFIRE_FIXED_TS': NOTES_UPDATED_OVERFIRE_FIXED_TS,
+	'event_spam_threshold': event_spam_threshold,
+	'view_spam_threshold': view_spam_threshold,
+}
+
+def constants_digest (constants):
+	# For anything stored that was derived with these constants (incremental state, dataset facts), to tell when it's stale
+	return hashlib.sha256(json.dumps(constants, sort_keys=True, default=str).encode()).hexdigest()
+
+EVENT_SPAM_GROUP_COLUMNS = ['session_id', 'event_name', 'data_key', 'string_value']
+VIEW_SPAM_GROUP_COLUMNS = ['session_id', 'event_type']
+
+# Developer sessions (see is_dev_session_row() below) in SQL, for sources that filter before loading (database.py, duckdb_backend.py); times are spelled out in full so text columns compare the same way
+DEV_SESSION_SQL = "(data_key = 'env' AND string_value = 'dev') OR (data_key = 'profile') OR (data_key = 'schoolId' AND string_value = '2' AND created_at > '2025-12-20 00:00:00' AND created_at < '2025-12-31 00:00:00')"
+DEV_SESSION_IDS_SQL = f'SELECT session_id FROM session_data WHERE session_id IS NOT NULL AND ({DEV_SESSION_SQL})'
+# Rows a database source can leave out of its queries, because cleaning always drops them:
+#  - every row of a developer session (user_sessions directly; website/event rows through their visit, and no spam group spans sessions)
+#  - website/event rows from before ANALYTICS_ADDED_TS (their visit is bad), except the last spam lookback's worth, which the spam filters still compare later rows with
+# (event rows are assumed to have their website event's created_at, as Umami writes them)
+DEV_SESSION_ROWS_SQL = f'session_id IN ({DEV_SESSION_IDS_SQL})'
+DROPPED_EVENT_ROWS_SQL = f"{DEV_SESSION_ROWS_SQL} OR created_at < '{(pd.Timestamp(ANALYTICS_ADDED_TS) - spam_lookback).strftime(UMAMI_TIMESTAMP_FORMAT)}'"
+# website_event rows that make their visit bad (see ExportFacts.collect_bad_visits())
+BAD_VISIT_ROWS_SQL = f"created_at < '{ANALYTICS_ADDED_TS}' OR {DEV_SESSION_ROWS_SQL}"
+
+# Cleaning rules, run in this order by run_filters() over the loaded frames
+# Every rule decides from the context (derived from the whole export), never from what an earlier rule removed, so they can be reordered freely
+def keep_non_dev_sessions (frame, context):
+	return ~context['dev_id_mask'][frame['session_id'].to_numpy()]
+
+def keep_after_start_bound (frame, context):
+	# Drops the rows that were only loaded so the spam filters could look back past the start bound
+	if not context['start_bound']: return np.ones(len(frame), dtype=bool)
+	return (frame['created_at'] > context['start_bound']).to_numpy()
+
+def keep_good_visits (frame, context):
+	return ~context['bad_we_visit_mask'][frame['visit_id'].to_numpy()]
+
+def keep_valid_notes_updates (frame, context):
+	return ~(
+		(frame['event_name'] == 'notes-updated').to_numpy() &
+		(frame['created_at'] < NOTES_UPDATED_OVERFIRE_FIXED_TS).to_numpy() &
+		(~context['valid_notes_updated_event_mask'][frame['event_id'].to_numpy()])
+	)
+
+def keep_good_visit_events (frame, context):
+	return ~context['bad_we_event_mask'][frame['event_id'].to_numpy()]
+
+def find_event_spam (context):
+	# Only newly loaded rows can be spam; rows from an earlier incremental run were already filtered
+	ed_df = context['loaded']['event_data']
+	ed_spam, context['event_spam_tail_updates'] = find_spam(ed_df, EVENT_SPAM_GROUP_COLUMNS, event_spam_threshold, tail=context['event_spam_tail'])
+	context['spam_event_mask'] = context['export_ids'].event.mask(ed_df.loc[ed_spam, 'event_id'])
+
+def keep_non_spam_events (frame, context):
+	return ~context['spam_event_mask'][frame['event_id'].to_numpy()]
+
+def find_view_spam (context):
+	we_df = context['loaded']['website_event']
+	we_spam, context['view_spam_tail_updates'] = find_spam(we_df, VIEW_SPAM_GROUP_COLUMNS, view_spam_threshold, tail=context['view_spam_tail'])
+	context['spam_view_event_mask'] = context['export_ids'].event.mask(we_df.loc[(we_spam & (we_df['event_type'] != 2).to_numpy()), 'event_id'])
+
+def keep_non_spam_views (frame, context):
+	return ~context['spam_view_event_mask'][frame['event_id'].to_numpy()]
+
+cleaning_stages = [
+	FilterStage('Developer sessions', ['user_sessions'], keep_non_dev_sessions),
+	FilterStage('Spam lookback rows', ['user_we_events', 'valid_ed_events'], keep_after_start_bound),
+	FilterStage('Developer/pre-analytics visits', ['user_we_events'], keep_good_visits),
+	FilterStage('Overfired notes-updated events', ['valid_ed_events', 'user_we_events'], keep_valid_notes_updates),
+	FilterStage('Developer/pre-analytics visit events', ['valid_ed_events'], keep_good_visit_events),
+	FilterStage('Event spam', ['valid_ed_events', 'user_we_events'], keep_non_spam_events, prepare=find_event_spam),
+	FilterStage('View spam', ['user_we_events'], keep_non_spam_views, prepare=find_view_spam),
+]
+
+# Rows an earlier incremental run already cleaned only go through the rules that rows appended since can still change:
+# a session can turn out to be a developer's, and with it every visit and event of it (a visit belongs to one session, and event rows carry their website event's session)
+earlier_rows_stages = [
+	FilterStage('Developer sessions (earlier runs)', ['user_sessions', 'user_we_events', 'valid_ed_events'], keep_non_dev_sessions),
+	FilterStage('Developer/pre-analytics visits (earlier runs)', ['user_we_events'], keep_good_visits),
+	FilterStage('Developer/pre-analytics visit events (earlier runs)', ['valid_ed_events'], keep_good_visit_events),
+]
+
+def is_dev_session_row (chunk):
+	cond_1 = ((chunk['data_key'] == 'env') & (chunk['string_value'] == 'dev')) # env=dev
+	cond_2 = (chunk['data_key'] == 'profile') # profile=[identifier for one of my testing devices]
+	cond_3 = ((chunk['data_key'] == 'schoolId') & (chunk['string_value'] == '2') & (chunk['created_at'] > '2025-12-20') & (chunk['created_at'] < '2025-12-31')) # no production Cal Aero (schoolId: 2) users during 2025 Dec 20-31, only developers
+	return (cond_1 | cond_2 | cond_3)
+
+def missing_to_none (values):
+	return [None if pd.isna(value) else value for value in values]
+
+class ExportFacts:
+	# What the cleaning rules need to know about the whole export, collected from every row while it streams in (ids are strings here)
+	# Every collection is a dict used as an ordered set, so the facts an incremental run added are the ones past what it started with
+	FRAME_COLUMNS = {
+		'dev_session_ids': ['session_id'],
+		'bad_visit_ids': ['visit_id'],
+		'bad_event_ids': ['event_id'],
+		'first_notes_lengths': ['session_id', 'length', 'event_id'],
+	}
+
+	def __init__ (self):
+		self.dev_session_ids = {}
+		self.bad_visit_ids = {}
+		self.bad_event_ids = {}
+		self.first_notes_lengths = {} # (session_id, length) -> event_id of the first notes length update with them
+		self.loaded = self.sizes()
+
+	def sizes (self):
+		return {name: len(getattr(self, name)) for name in self.FRAME_COLUMNS}
+
+	def collect_dev_sessions (self, chunk):
+		# session_data chunks
+		self.dev_session_ids.update(dict.fromkeys(chunk.loc[is_dev_session_row(chunk), 'session_id'].dropna()))
+
+	def collect_bad_visits (self, chunk):
+		# website_event chunks, once every developer session is known; a visit is bad if any of its rows is pre-analytics or from a developer session
+		bad_we_visits_mask = (
+			(chunk['created_at'] < ANALYTICS_ADDED_TS) |
+			(chunk['session_id'].isin(self.dev_session_ids.keys()))
+		)
+		self.bad_visit_ids.update(dict.fromkeys(chunk.loc[bad_we_visits_mask, 'visit_id'].dropna()))
+		self.bad_event_ids.update(dict.fromkeys(chunk.loc[bad_we_visits_mask, 'event_id'].dropna()))
+
+	def collect_first_notes_lengths (self, chunk):
+		# event_data chunks; only the first notes length update of every (session, length) is valid (see keep_valid_notes_updates())
+		notes_lengths = chunk[(
+			(chunk['event_name'] == 'notes-updated') &
+			(chunk['data_key'] == 'length')
+		)].drop_duplicates(subset=['session_id', 'string_value'])
+		for session_id, length, event_id in zip(*(missing_to_none(notes_lengths[column]) for column in ['session_id', 'string_value', 'event_id'])):
+			self.first_notes_lengths.setdefault((session_id, length), event_id)
+
+	def collector (self, table):
+		# The collect_*() method for chunks of table; tables have to be collected in EXPORT_TABLES order
+		return {'session_data': self.collect_dev_sessions, 'website_event': self.collect_bad_visits, 'event_data': self.collect_first_notes_lengths}[table]
+
+	def masks (self, export_ids):
+		# The facts as bitmaps over the final codes (see encoding.IdVocabulary.mask()), for the cleaning context
+		return {
+			'dev_id_mask': export_ids.session.mask(export_ids.session.codes(self.dev_session_ids)),
+			'bad_we_visit_mask': export_ids.visit.mask(export_ids.visit.codes(self.bad_visit_ids)),
+			'bad_we_event_mask': export_ids.event.mask(export_ids.event.codes(self.bad_event_ids)),
+			'valid_notes_updated_event_mask': export_ids.event.mask(export_ids.event.codes(event_id for event_id in self.first_notes_lengths.values() if event_id is not None)),
+		}
+
+	def to_frames (self, added_only=False):
+		# {name: frame of facts}, or only those collected since loading (what an incremental run has to store)
+		frames = {}
+		for name, columns in self.FRAME_COLUMNS.items():
+			facts = itertools.islice(getattr(self, name).items(), self.loaded[name] if added_only else 0, None)
+			rows = [(*key, value) for key, value in facts] if name == 'first_notes_lengths' else [(key,) for key, _ in facts]
+			frames[name] = pd.DataFrame(rows, columns=columns, dtype=object)
+		return frames
+
+	@classmethod
+	def from_frames (cls, frames):
+		facts = cls()
+		for name, columns in cls.FRAME_COLUMNS.items():
+			values = [missing_to_none(frames[name][column]) for column in columns]
+			if name == 'first_notes_lengths':
+				for session_id, length, event_id in zip(*values):
+					facts.first_notes_lengths.setdefault((session_id, length), event_id)
+			else:
+				getattr(facts, name).update(dict.fromkeys(values[0]))
+		facts.loaded = facts.sizes()
+		return facts
+
+def whole_table_rows (table, facts):
+	# The columns and rows of table that facts.collector(table) needs, as pyarrow filters and as SQL, so datasets and databases can skip the rest of the table
+	if table == 'session_data':
+		return {
+			'columns': ['session_id', 'data_key', 'string_value', 'created_at'],
+			'filters': [[('data_key', 'in', ['env', 'profile', 'schoolId'])]],
+			'where': "data_key IN ('env', 'profile', 'schoolId')",
+		}
+	if table == 'website_event':
+		return {
+			'columns': ['session_id', 'visit_id', 'event_id', 'created_at'],
+			'filters': [[('created_at', '<', pd.Timestamp(ANALYTICS_ADDED_TS))]] + ([[('session_id', 'in', list(facts.dev_session_ids))]] if facts.dev_session_ids else []),
+			'where': BAD_VISIT_ROWS_SQL,
+		}
+	return {
+		'columns': ['session_id', 'event_id', 'event_name', 'data_key', 'string_value'],
+		'filters': [[('event_name', '==', 'notes-updated'), ('data_key', '==', 'length')]],
+		'where': "event_name = 'notes-updated' AND data_key = 'length'",
+	}
@@ -0,0 +1,31 @@
+import json
+import os
+
+# What country_converter calls a code it doesn't know; a missing code gets it without asking
+UNKNOWN_COUNTRY_NAME = 'not found'
+
+def is_missing (code):
+	return code is None or code != code # None from DuckDB, NaN from pandas
+
+def resolve_country_names (codes, memo_path):
+	# ISO 3166-1 alpha-2 codes -> country names (in the same order), remembered on disk so country_converter (slow to import and set up) is only loaded when a new code shows up
+	# A missing or unreadable memo (e.g. one cut short or mangled by hand) only means the names get looked up again
+	try:
+		with open(memo_path) as memo_file:
+			memo = json.load(memo_file)
+	except (OSError, ValueError):
+		memo = {}
+	if not isinstance(memo, dict): memo = {}
+	new_codes = [code for code in codes if not is_missing(code) and code not in memo]
+	if new_codes:
+		import country_converter as coco
+		names = coco.CountryConverter().convert(names=new_codes, to='name')
+		if isinstance(names, str): names = [names] # a single name comes back unwrapped
+		memo.update(zip(new_codes, names))
+		os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+		# Written to a temporary file first, since report sections for several windows can run in parallel
+		temp_path = memo_path + f'.tmp-{os.getpid()}'
+		with open(temp_path, 'w') as memo_file:
+			json.dump(memo, memo_file, indent='\t', sort_keys=True)
+		os.replace(temp_path, memo_path)
+	return [UNKNOWN_COUNTRY_NAME if is_missing(code) else memo[code] for code in codes]
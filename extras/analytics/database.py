@@ -0,0 +1,272 @@
+import argparse
+import contextlib
+import queue
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from .cleaning import BAD_VISIT_ROWS_SQL, DEV_SESSION_SQL, ExportFacts
+from .ingest import EXPORT_COLUMNS, EXPORT_TABLES, TableSummary, concat_chunks, export_csv_path, window_start
+# Postgres needs psycopg (3, or else 2); SQLite comes with Python
+try:
+	import psycopg
+	has_postgres = True
+except ImportError:
+	try:
+		import psycopg2 as psycopg
+		has_postgres = True
+	except ImportError:
+		has_postgres = False
+
+# Reads session_data, website_event and event_data straight from Umami's own database (or a stand-in with its schema, loaded by main() below), as the export's rows of them
+# Umami keeps device/country on the session, and event_data rows only point to their website event, so those export columns come from joins (see UMAMI_JOINS)
+# Only the report's columns are selected, and time bounds and whatever the caller knows cleaning always drops are pushed into the WHERE clause, so only rows that can end up in the report reach Python
+# What cleaning derives from the whole export is computed in the database as distinct ids (see export_facts()); queries run at once on pooled connections and are fetched in batches
+# Tables are read in physical row order (SQLite rowid, Postgres ctid), which is the order a plain export dumps them in, since the report breaks ties by row order
+DATABASE_URL_PREFIXES = {
+	'sqlite:///': 'sqlite',
+	'postgresql://': 'postgresql',
+	'postgres://': 'postgresql',
+}
+ROW_ORDER = {
+	'sqlite': 'rowid',
+	'postgresql': 'ctid',
+}
+# Per table: the joins that bring in the export columns it lacks, and where those columns come from (every other column is the table's own)
+UMAMI_JOINS = {
+	'session_data': ('', {}),
+	'website_event': ('LEFT JOIN session ON session.session_id = website_event.session_id', {
+		'device': 'session.device',
+		'country': 'session.country',
+	}),
+	'event_data': ('LEFT JOIN website_event ON website_event.event_id = event_data.website_event_id', {
+		'session_id': 'website_event.session_id',
+		'event_id': 'event_data.website_event_id',
+		'event_name': 'website_event.event_name',
+	}),
+}
+# Columns of an export's website_event rows that Umami keeps on their session instead (the session's first row in the export gives them)
+SESSION_COLUMNS = ['session_id', 'website_id', 'browser', 'os', 'device', 'screen', 'language', 'country', 'region', 'city', 'distinct_id', 'created_at']
+# Columns of an export's event_data rows that Umami keeps on their website event instead
+EVENT_COLUMNS = ['session_id', 'url_path', 'event_name']
+DEFAULT_POOL_SIZE = 4
+FETCH_BATCH_ROWS = 50000
+
+def database_dialect (source):
+	# 'sqlite'/'postgresql' for a database URL, else None (e.g. for an export directory)
+	return next((dialect for prefix, dialect in DATABASE_URL_PREFIXES.items() if source.startswith(prefix)), None)
+
+def is_database (source):
+	return database_dialect(source) is not None
+
+def naive_utc (times):
+	# Fetched created_at values (text from SQLite, timezone-aware datetimes from Postgres) as naive UTC times, like the export's
+	return pd.to_datetime(times, utc=True).dt.tz_localize(None)
+
+class ConnectionPool:
+	# Up to size idle connections are kept for reuse, so concurrent queries (and later reports in the same process) don't each open their own
+	def __init__ (self, connect, size=DEFAULT_POOL_SIZE):
+		self.connect = connect
+		self.size = size
+		self.idle = queue.LifoQueue()
+
+	@contextlib.contextmanager
+	def connection (self):
+		try:
+			connection = self.idle.get_nowait()
+		except queue.Empty:
+			connection = self.connect()
+		try:
+			yield connection
+		finally:
+			if self.idle.qsize() < self.size:
+				self.idle.put(connection)
+			else:
+				connection.close()
+
+	def close (self):
+		while not self.idle.empty():
+			self.idle.get_nowait().close()
+
+# One instance (and pool) per URL, shared by every load in the process
+open_databases = {}
+
+class UmamiDatabase:
+	def __init__ (self, url, pool_size=DEFAULT_POOL_SIZE):
+		self.url = url
+		self.dialect = database_dialect(url)
+		if self.dialect == 'postgresql' and not has_postgres:
+			raise RuntimeError('Reading from Postgres needs psycopg (pip install psycopg)')
+		self.placeholder = '?' if self.dialect == 'sqlite' else '%s'
+		self.pool = ConnectionPool(self.connect, pool_size)
+
+	@classmethod
+	def open (cls, url):
+		if url not in open_databases:
+			open_databases[url] = cls(url)
+		return open_databases[url]
+
+	def connect (self):
+		if self.dialect == 'sqlite':
+			# Read-only, so a mistyped path fails instead of creating an empty database
+			return sqlite3.connect(f'file:{self.url.removeprefix('sqlite:///')}?mode=ro', uri=True, check_same_thread=False)
+		# Umami's created_at is a timestamptz, and the export's times are UTC; in UTC, the naive times in cleaning's SQL (and timestamps without a zone) mean the same
+		# (committed, since the pool rolls back after every read, which would undo the SET too)
+		connection = psycopg.connect(self.url)
+		cursor = connection.cursor()
+		try:
+			cursor.execute("SET TIME ZONE 'UTC'")
+		finally:
+			cursor.close()
+		connection.commit()
+		return connection
+
+	def timestamp_parameter (self, value):
+		# SQLite stores created_at as text ('YYYY-MM-DD HH:MM:SS', which sorts like the time); Postgres compares timestamps, given in UTC like the export's
+		return str(pd.Timestamp(value)) if self.dialect == 'sqlite' else pd.Timestamp(value).tz_localize('UTC').to_pydatetime()
+
+	def fetch_batches (self, query, parameters=()):
+		# Yields lists of up to FETCH_BATCH_ROWS rows; Postgres uses a server-side cursor, so the result is never buffered whole on this side either
+		with self.pool.connection() as connection:
+			cursor = connection.cursor(name='analytics_fetch') if self.dialect == 'postgresql' else connection.cursor()
+			try:
+				cursor.execute(query, parameters)
+				while batch := cursor.fetchmany(FETCH_BATCH_ROWS):
+					yield batch
+			finally:
+				cursor.close()
+				if self.dialect == 'postgresql': connection.rollback() # ends the read's transaction
+
+	def fetch_row (self, query, parameters=()):
+		with self.pool.connection() as connection:
+			cursor = connection.cursor()
+			try:
+				cursor.execute(query, parameters)
+				return cursor.fetchone()
+			finally:
+				cursor.close()
+				if self.dialect == 'postgresql': connection.rollback()
+
+	def export_rows (self, table):
+		# Subquery of the table's rows with the export's columns, and row_order
+		join, joined_columns = UMAMI_JOINS[table]
+		columns = [f'{joined_columns.get(column, f'{table}.{column}')} AS {column}' for column in EXPORT_COLUMNS[table]]
+		return f'(SELECT {table}.{ROW_ORDER[self.dialect]} AS row_order, {', '.join(columns)} FROM {table} {join}) AS export_rows'
+
+	def fetch_frame (self, table, columns, conditions, parameters=()):
+		# The table's rows matching every condition, typed like ingest.read_export_table() would, in row order; returns (frame, rows fetched)
+		dtypes = {column: dtype for column, dtype in EXPORT_COLUMNS[table].items() if column in columns}
+		query = f'SELECT {', '.join(columns)} FROM {self.export_rows(table)}{(' WHERE ' + ' AND '.join(f'({condition})' for condition in conditions)) if conditions else ''} ORDER BY row_order'
+		chunks = []
+		for batch in self.fetch_batches(query.replace('?', self.placeholder), parameters):
+			chunk = pd.DataFrame.from_records(batch, columns=columns)
+			chunk = chunk.astype({column: dtype for column, dtype in dtypes.items() if dtype != 'datetime'})
+			for column in [column for column, dtype in dtypes.items() if dtype == 'datetime']:
+				chunk[column] = naive_utc(chunk[column])
+			chunks.append(chunk)
+		return concat_chunks(chunks, dtypes), sum(map(len, chunks))
+
+	def summary (self, table):
+		# TableSummary of the whole table, aggregated in the database
+		rows, earliest, latest = self.fetch_row(f'SELECT count(*), min(created_at), max(created_at) FROM {table}')
+		earliest, latest = naive_utc(pd.Series([earliest, latest]))
+		return TableSummary.from_dict({'rows': rows, 'earliest': None if pd.isna(earliest) else str(earliest), 'latest': None if pd.isna(latest) else str(latest)})
+
+	def fetch_values (self, query):
+		# Every row of the query, as strings (Postgres gives UUIDs as uuid.UUID) or None
+		return [[None if value is None else str(value) for value in row] for batch in self.fetch_batches(query) for row in batch]
+
+	def export_facts (self, constants):
+		# ExportFacts from the distinct ids the cleaning rules need, so none of the rows they come from are fetched; the queries always use the current cleaning constants
+		queries = {
+			'dev_session_ids': f'SELECT DISTINCT session_id FROM session_data WHERE session_id IS NOT NULL AND ({DEV_SESSION_SQL})',
+			'bad_visit_ids': f'SELECT DISTINCT visit_id FROM website_event WHERE visit_id IS NOT NULL AND ({BAD_VISIT_ROWS_SQL})',
+			'bad_event_ids': f'SELECT DISTINCT event_id FROM website_event WHERE event_id IS NOT NULL AND ({BAD_VISIT_ROWS_SQL})',
+			# The first notes length update of every (session, length), by row order
+			'first_notes_lengths': f'''SELECT session_id, string_value, event_id FROM (
+				SELECT session_id, string_value, event_id, row_number() OVER (PARTITION BY session_id, string_value ORDER BY row_order) AS update_number
+				FROM {self.export_rows('event_data')} WHERE event_name = 'notes-updated' AND data_key = 'length'
+			) AS notes_lengths WHERE update_number = 1''',
+		}
+		with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+			values = {name: executor.submit(self.fetch_values, query) for name, query in queries.items()}
+			return ExportFacts.from_frames({name: pd.DataFrame(values[name].result(), columns=columns, dtype=object) for name, columns in ExportFacts.FRAME_COLUMNS.items()})
+
+	def read_table (self, table, start_bound=None, end_bound=None, lookback=None, on_chunk=None, ids=None, whole_table_rows=None, excluded_rows=None):
+		# Same as ingest.read_export_table(), with the window and excluded_rows (an SQL condition for rows cleaning always drops) applied in the query
+		# on_chunk only sees the whole table's rows matching whole_table_rows = {'columns': [...], 'where': SQL condition}, if given, so it must not depend on anything else (export_facts() makes it unnecessary)
+		# Returns (windowed frame, TableSummary of the whole table, rows fetched)
+		conditions, parameters = [], []
+		keep_after = window_start(start_bound, lookback)
+		if keep_after is not None:
+			conditions.append('created_at >= ?' if lookback is not None else 'created_at > ?')
+			parameters.append(self.timestamp_parameter(keep_after))
+		if end_bound:
+			conditions.append('created_at < ?')
+			parameters.append(self.timestamp_parameter(end_bound))
+		if excluded_rows:
+			conditions.append(f'({excluded_rows}) IS NOT TRUE')
+		with ThreadPoolExecutor(max_workers=3) as executor:
+			summary = executor.submit(self.summary, table)
+			window = executor.submit(self.fetch_frame, table, list(EXPORT_COLUMNS[table]), conditions, parameters)
+			whole_table = None
+			if on_chunk:
+				whole_table = executor.submit(self.fetch_frame, table, *((whole_table_rows['columns'], [whole_table_rows['where']]) if whole_table_rows else (list(EXPORT_COLUMNS[table]), [])))
+			frame, rows_fetched = window.result()
+			if whole_table:
+				whole_table_frame, whole_table_rows_fetched = whole_table.result()
+				on_chunk(whole_table_frame)
+				rows_fetched += whole_table_rows_fetched
+			if ids is not None: ids.encode_frame(frame)
+			return frame, summary.result(), rows_fetched
+
+def load_export (export_dir, url):
+	# Loads an export's CSVs (every column, as text, created_at exactly as exported) into a SQLite database with Umami's tables, e.g. as a stand-in for Umami's own database:
+	# website_event rows' session columns go to one session row per session, event_data rows point to their website event by website_event_id, and data rows get ids
+	if database_dialect(url) != 'sqlite':
+		raise ValueError('Only SQLite stand-ins can be loaded (give a sqlite:/// URL)')
+	connection = sqlite3.connect(url.removeprefix('sqlite:///'))
+	def read_chunks (table):
+		with pd.read_csv(export_csv_path(export_dir, table), dtype=str, chunksize=FETCH_BATCH_ROWS) as reader:
+			yield from reader
+	def new_ids (chunk):
+		return [str(uuid.uuid4()) for _ in range(len(chunk))]
+	try:
+		for table in ('session', *EXPORT_TABLES):
+			connection.execute(f'DROP TABLE IF EXISTS {table}')
+		for chunk in read_chunks('session_data'):
+			chunk.insert(0, 'session_data_id', new_ids(chunk))
+			chunk.to_sql('session_data', connection, if_exists='append', index=False)
+		seen_sessions = set()
+		for chunk in read_chunks('website_event'):
+			sessions = chunk[SESSION_COLUMNS].dropna(subset=['session_id']).drop_duplicates('session_id')
+			sessions = sessions[~sessions['session_id'].isin(seen_sessions)]
+			seen_sessions.update(sessions['session_id'])
+			sessions.to_sql('session', connection, if_exists='append', index=False)
+			chunk = chunk.drop(columns=[column for column in SESSION_COLUMNS if column not in ('session_id', 'website_id', 'created_at')])
+			chunk['event_type'] = chunk['event_type'].astype('int64')
+			chunk.to_sql('website_event', connection, if_exists='append', index=False)
+		for chunk in read_chunks('event_data'):
+			chunk = chunk.drop(columns=EVENT_COLUMNS).rename(columns={'event_id': 'website_event_id'})
+			chunk.insert(0, 'event_data_id', new_ids(chunk))
+			chunk.to_sql('event_data', connection, if_exists='append', index=False)
+		connection.execute('CREATE UNIQUE INDEX session_session_id ON session (session_id)')
+		connection.execute('CREATE INDEX website_event_event_id ON website_event (event_id)')
+		connection.execute('CREATE INDEX event_data_website_event_id ON event_data (website_event_id)')
+		for table in EXPORT_TABLES:
+			connection.execute(f'CREATE INDEX {table}_created_at ON {table} (created_at)')
+		for table in ('session_data', 'website_event'):
+			connection.execute(f'CREATE INDEX {table}_session_id ON {table} (session_id)')
+		connection.commit()
+	finally:
+		connection.close()
+
+def main (argv=None):
+	parser = argparse.ArgumentParser(description='Loads an Umami export into a SQLite database that the report can read like Umami\'s own (e.g. python -m analytics sqlite:///umami.db).')
+	parser.add_argument('export_dir', help='export directory with session_data.csv, website_event.csv and event_data.csv')
+	parser.add_argument('url', help='database to (re)create the tables in, e.g. sqlite:///umami.db')
+	args = parser.parse_args(argv)
+	load_export(args.export_dir, args.url)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from .cache import has_parquet
+from .cleaning import ExportFacts, cleaning_constants, constants_digest, whole_table_rows
+from .ingest import EXPORT_COLUMNS, EXPORT_TABLES, TableSummary, export_csv_path, read_export_chunks, window_rows, window_start
+from .pipeline import Instrumentation
+# Datasets are parquet files, so they need pyarrow (see cache.has_parquet)
+if has_parquet:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+
+# A dataset merges any number of Umami exports into one copy of every table, partitioned by month of created_at:
+#   <dataset dir>/dataset.json                      manifest: the exports it was built from, and every partition's rows/earliest/latest
+#   <dataset dir>/<table>/<YYYY-MM or none>.parquet  one table's rows of one month (none = no created_at)
+#   <dataset dir>/facts/<name>.parquet               the whole-dataset facts cleaning decides from (cleaning.ExportFacts), for the cleaning constants in the manifest
+# Exports overlap (each one is a full dump), so rows are deduplicated across exports by DEDUPE_KEYS; a later export's copy of a row wins
+# Rows within one export are never deduplicated, so a dataset built from a single export holds exactly its rows, and reports on it are the same as on the CSVs
+# Every row keeps its position (export number, then row in the CSV) as row, and tables are always read back in that order, since the report breaks ties by row order
+# A bounded read only opens the partitions whose rows can fall inside the bounds, since the facts cleaning needs from the rest were collected when the dataset was built
+# (if the cleaning constants changed since, the other partitions are scanned for the few columns/rows the facts come from, as in a dataset without them)
+DATASET_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = 'dataset.json'
+NO_TIME_PARTITION = 'none'
+FACTS_DIR_NAME = 'facts'
+ROW_COLUMN = 'row'
+EXPORT_ROW_STRIDE = 2 ** 40 # row = export number * stride + row in its CSV
+DEDUPE_KEYS = {
+	'session_data': ['session_id', 'data_key'],
+	'website_event': ['event_id'],
+	'event_data': ['event_id', 'data_key'],
+}
+
+def is_dataset (path):
+	return os.path.exists(os.path.join(path, MANIFEST_FILE_NAME))
+
+def export_input_paths (export_dir):
+	# Files whose contents decide what export_dir (an export or a dataset) holds, e.g. for cache keys
+	if is_dataset(export_dir):
+		return ExportDataset(export_dir).paths()
+	return [export_csv_path(export_dir, table) for table in EXPORT_TABLES]
+
+def table_schema (table):
+	arrow_types = {'str': pa.string(), 'category': pa.string(), 'datetime': pa.timestamp('us'), 'int8': pa.int8()}
+	return pa.schema([(column, arrow_types[dtype]) for column, dtype in EXPORT_COLUMNS[table].items()] + [(ROW_COLUMN, pa.int64())])
+
+def partition_names (created_at):
+	# 'YYYY-MM' of every row, NO_TIME_PARTITION where created_at is missing
+	months = (created_at.dt.year * 100 + created_at.dt.month).to_numpy(dtype='float64', na_value=np.nan)
+	return [NO_TIME_PARTITION if np.isnan(month) else f'{int(month) // 100:04d}-{int(month) % 100:02d}' for month in months]
+
+def merge_table (export_dirs, table, table_dir):
+	# Newest export first, so every row can be checked against the keys of all newer exports; returns (rows read, {partition: stats})
+	os.makedirs(table_dir)
+	columns = {column: ('str' if dtype == 'category' else dtype) for column, dtype in EXPORT_COLUMNS[table].items()}
+	key_columns = DEDUPE_KEYS[table]
+	schema = table_schema(table)
+	writers = {}
+	newer_keys = np.empty(0, dtype='uint64') # hashes of every key seen in a newer export, sorted
+	rows_in = 0
+	try:
+		for export_number in reversed(range(len(export_dirs))):
+			export_keys = []
+			position = export_number * EXPORT_ROW_STRIDE
+			for chunk in read_export_chunks(export_csv_path(export_dirs[export_number], table), columns):
+				rows_in += len(chunk)
+				chunk[ROW_COLUMN] = np.arange(position, position + len(chunk), dtype='int64')
+				position += len(chunk)
+				has_key = chunk[key_columns].notna().all(axis=1).to_numpy() # rows missing part of their key are always kept
+				keys = pd.util.hash_pandas_object(chunk[key_columns], index=False).to_numpy()
+				export_keys.append(keys[has_key])
+				chunk = chunk[~(has_key & np.isin(keys, newer_keys))]
+				for partition, rows in chunk.groupby(partition_names(chunk['created_at']), sort=False):
+					if partition not in writers:
+						writers[partition] = pq.ParquetWriter(os.path.join(table_dir, partition + '.parquet'), schema)
+					writers[partition].write_table(pa.Table.from_pandas(rows, schema=schema, preserve_index=False))
+			newer_keys = np.union1d(newer_keys, np.concatenate(export_keys) if export_keys else newer_keys)
+	finally:
+		for writer in writers.values():
+			writer.close()
+	# Partitions were written newest export first; rewrite each one in row order
+	partitions = {}
+	for partition in sorted(writers):
+		path = os.path.join(table_dir, partition + '.parquet')
+		rows = pq.read_table(path).sort_by(ROW_COLUMN)
+		pq.write_table(rows, path)
+		created_at = rows.column('created_at').to_pandas()
+		partitions[partition] = {
+			'rows': rows.num_rows,
+			'earliest': None if created_at.isna().all() else str(created_at.min()),
+			'latest': None if created_at.isna().all() else str(created_at.max()),
+		}
+	return rows_in, partitions
+
+def collect_facts (dataset_dir, manifest):
+	# ExportFacts of a dataset, from the same columns/rows of every partition that a read of the whole dataset would collect them from
+	facts = ExportFacts()
+	for table in EXPORT_TABLES:
+		rows = whole_table_rows(table, facts)
+		paths = [os.path.join(dataset_dir, table, partition + '.parquet') for partition in manifest['tables'][table]['partitions']]
+		pieces = [pq.read_table(path, columns=[*rows['columns'], ROW_COLUMN], filters=rows['filters']) for path in paths]
+		if pieces:
+			facts.collector(table)(pa.concat_tables(pieces).sort_by(ROW_COLUMN).to_pandas())
+	return facts
+
+def build_dataset (export_dirs, dataset_dir, instrumentation=None):
+	# export_dirs go from oldest to newest; the dataset is rebuilt from scratch in a temporary directory, then swapped in
+	if not has_parquet:
+		raise RuntimeError('Building a dataset needs pyarrow')
+	# Only a dataset (or an empty directory) gets replaced, so a mistyped or swapped argument can't delete an export or anything else
+	if os.path.exists(dataset_dir) and not is_dataset(dataset_dir) and (not os.path.isdir(dataset_dir) or os.listdir(dataset_dir)):
+		raise ValueError(f'{dataset_dir} exists and is not a dataset ({MANIFEST_FILE_NAME} is missing), so it was left alone')
+	if instrumentation is None: instrumentation = Instrumentation()
+	temp_dir = os.path.normpath(dataset_dir) + f'.tmp-{os.getpid()}'
+	shutil.rmtree(temp_dir, ignore_errors=True)
+	manifest = {'format': DATASET_FORMAT_VERSION, 'exports': [os.path.abspath(export_dir) for export_dir in export_dirs], 'tables': {}}
+	for table in EXPORT_TABLES:
+		with instrumentation.stage(f'Merge {table}') as record:
+			record['rows_in'], partitions = merge_table(export_dirs, table, os.path.join(temp_dir, table))
+			record['rows_out'] = sum(partition['rows'] for partition in partitions.values())
+		manifest['tables'][table] = {'partitions': partitions}
+	with instrumentation.stage('Collect facts') as record:
+		facts = collect_facts(temp_dir, manifest)
+		os.makedirs(os.path.join(temp_dir, FACTS_DIR_NAME))
+		for name, frame in facts.to_frames().items():
+			frame.to_parquet(os.path.join(temp_dir, FACTS_DIR_NAME, name + '.parquet'), index=False)
+		record['rows_out'] = sum(facts.sizes().values())
+	manifest['facts'] = {'constants': constants_digest(cleaning_constants)}
+	with open(os.path.join(temp_dir, MANIFEST_FILE_NAME), 'w') as manifest_file:
+		json.dump(manifest, manifest_file, indent='\t')
+	shutil.rmtree(dataset_dir, ignore_errors=True)
+	os.replace(temp_dir, dataset_dir)
+	return ExportDataset(dataset_dir)
+
+class ExportDataset:
+	# Reads a dataset written by build_dataset(), table by table, the same way ingest.read_export_table() reads an export CSV
+	def __init__ (self, dataset_dir):
+		if not has_parquet:
+			raise RuntimeError('Reading a dataset needs pyarrow')
+		self.dataset_dir = dataset_dir
+		with open(os.path.join(dataset_dir, MANIFEST_FILE_NAME)) as manifest_file:
+			self.manifest = json.load(manifest_file)
+		if self.manifest['format'] != DATASET_FORMAT_VERSION:
+			raise ValueError(f'{dataset_dir} is a version {self.manifest['format']} dataset, expected version {DATASET_FORMAT_VERSION}; rebuild it with python -m analytics.dataset')
+
+	def partitions (self, table):
+		return self.manifest['tables'][table]['partitions']
+
+	def partition_path (self, table, partition):
+		return os.path.join(self.dataset_dir, table, partition + '.parquet')
+
+	def paths (self):
+		return [os.path.join(self.dataset_dir, MANIFEST_FILE_NAME)] + [self.partition_path(table, partition) for table in EXPORT_TABLES for partition in self.partitions(table)]
+
+	def summary (self, table):
+		# TableSummary of the whole table, from the manifest
+		partitions = self.partitions(table).values()
+		earliest = [partition['earliest'] for partition in partitions if partition['earliest']]
+		latest = [partition['latest'] for partition in partitions if partition['latest']]
+		return TableSummary.from_dict({
+			'rows': sum(partition['rows'] for partition in partitions),
+			'earliest': str(min(map(pd.Timestamp, earliest))) if earliest else None,
+			'latest': str(max(map(pd.Timestamp, latest))) if latest else None,
+		})
+
+	def partitions_in_window (self, table, start_bound=None, end_bound=None, lookback=None):
+		# Partitions that can hold rows inside the (start_bound - lookback, end_bound) window, judged by their earliest/latest rows
+		if not start_bound and not end_bound:
+			return list(self.partitions(table))
+		keep_after = window_start(start_bound, lookback)
+		return [name for name, partition in self.partitions(table).items() if partition['earliest'] and (
+			(keep_after is None or pd.Timestamp(partition['latest']) >= keep_after) and
+			(not end_bound or pd.Timestamp(partition['earliest']) < pd.Timestamp(end_bound))
+		)]
+
+	def export_facts (self, constants):
+		# The ExportFacts stored at build time, or None if they were collected with other cleaning constants (or the dataset predates them)
+		if self.manifest.get('facts', {}).get('constants') != constants_digest(constants):
+			return None
+		return ExportFacts.from_frames({name: pd.read_parquet(os.path.join(self.dataset_dir, FACTS_DIR_NAME, name + '.parquet')) for name in ExportFacts.FRAME_COLUMNS})
+
+	def read_table (self, table, start_bound=None, end_bound=None, lookback=None, on_chunk=None, ids=None, whole_table_rows=None, excluded_rows=None):
+		# Same as ingest.read_export_table() (one chunk: the rows read, in row order), except that partitions outside the window are only read for on_chunk (not needed when export_facts() has the facts),
+		# and then only whole_table_rows = {'columns': [...], 'filters': pyarrow filters} of them, if given; on_chunk must not depend on anything else outside the window
+		# excluded_rows (SQL) is ignored; cleaning drops those rows anyway
+		# Returns (windowed frame, TableSummary of the whole table, rows read)
+		columns = EXPORT_COLUMNS[table]
+		inside = self.partitions_in_window(table, start_bound, end_bound, lookback)
+		pieces = [pq.read_table(self.partition_path(table, partition)) for partition in inside]
+		if on_chunk:
+			outside_columns, outside_filters = (whole_table_rows['columns'], whole_table_rows['filters']) if whole_table_rows else (list(columns), None)
+			for partition in self.partitions(table):
+				if partition not in inside:
+					pieces.append(pq.read_table(self.partition_path(table, partition), columns=[*outside_columns, ROW_COLUMN], filters=outside_filters or None))
+		rows = pa.concat_tables(pieces, promote_options='default').sort_by(ROW_COLUMN) if pieces else table_schema(table).empty_table()
+		chunk = rows.to_pandas()[list(columns)] # columns only read outside the window are all missing
+		if on_chunk: on_chunk(chunk)
+		frame = window_rows(chunk, start_bound, end_bound, lookback)
+		# Only rows inside the window are left, so every column can take its usual dtype again
+		frame = frame.astype({column: dtype for column, dtype in columns.items() if dtype != 'datetime'}).reset_index(drop=True)
+		if ids is not None: ids.encode_frame(frame)
+		return frame, self.summary(table), rows.num_rows
+
+def main (argv=None):
+	parser = argparse.ArgumentParser(description='Merges Umami exports into one deduplicated dataset, partitioned by month, that the report (python -m analytics) can read in place of an export.')
+	parser.add_argument('dataset_dir', help='dataset to (re)build')
+	parser.add_argument('export_dirs', nargs='+', help='export directories, oldest first; where exports share a row, the latest one wins')
+	args = parser.parse_args(argv)
+
+	instrumentation = Instrumentation()
+	try:
+		dataset = build_dataset(args.export_dirs, args.dataset_dir, instrumentation)
+	except ValueError as error:
+		parser.error(str(error))
+	for table in EXPORT_TABLES:
+		partition_count = len(dataset.partitions(table))
+		print(f'{table}: {dataset.summary(table).rows} rows in {partition_count} {'partition' if partition_count == 1 else 'partitions'}')
+	print()
+	print('\n'.join(instrumentation.lines()))
+
+if __name__ == '__main__':
+	main()
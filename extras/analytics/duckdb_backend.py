@@ -0,0 +1,277 @@
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+import pandas as pd
+from datetime import datetime, UTC
+from . import cleaning
+from . import report
+from .cache import DEFAULT_CACHE_DIR
+from .countries import resolve_country_names
+from .dataset import ExportDataset, ROW_COLUMN, is_dataset
+from .ingest import DEFAULT_EXPORT_DIR, EXPORT_COLUMNS, EXPORT_TABLES, UMAMI_TIMESTAMP_FORMAT, TableSummary, export_csv_path
+from .pipeline import Instrumentation
+# DuckDB is optional; only needed for --backend duckdb
+try:
+	import duckdb
+	has_duckdb = True
+except ImportError:
+	has_duckdb = False
+
+# Out-of-core backend: the exports are loaded into an on-disk DuckDB database and cleaned/aggregated there with SQL, spilling to disk past memory_limit
+# Only the columns the report uses are read from the CSVs, bounds are pushed into every query, and only per-session/per-group aggregates come back to pandas
+# Results are the same dicts the pandas sections compute (and render the same way), so the two backends print byte-identical reports:
+#  - every table keeps its CSV row order as pos, standing in for the pandas frames' row order wherever pandas breaks ties by first appearance
+#  - NULL handling follows pandas (groupby/value_counts drop missing keys unless told otherwise, unique()/drop_duplicates() keep one missing value)
+#  - whatever pandas computes in floating point (mean, quantiles, percentiles) is computed by the same pandas code from the aggregates
+
+# Strings pandas.read_csv() reads as missing by default
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+SQL_TYPES = {
+	'str': 'VARCHAR',
+	'category': 'VARCHAR',
+	'datetime': 'TIMESTAMP',
+	'int8': 'TINYINT',
+}
+CLEANED_TABLES = ('user_sessions', 'user_we_events', 'valid_ed_events')
+
+def sql_string (value):
+	return "'" + str(value).replace("'", "''") + "'"
+
+def sql_timestamp (value):
+	return f'TIMESTAMP {sql_string(pd.Timestamp(value))}'
+
+def not_in (column, table):
+	# NOT IN that keeps rows whose column is NULL, like ~bitmap[codes] does in the pandas path
+	return f'NOT coalesce({column} IN (SELECT {column} FROM {table}), false)'
+
+def remove_database (connection, database_dir):
+	connection.close()
+	shutil.rmtree(database_dir, ignore_errors=True)
+
+def nullable_timestamp (value):
+	return pd.NaT if value is None else pd.Timestamp(value)
+
+class DuckDBAnalyticsData:
+	# Same interface as analyze.AnalyticsData (load(), report(), report_series(), last_record()), backed by a DuckDB database instead of pandas frames
+	def __init__ (self, connection, database_dir, summaries, cache_dir=DEFAULT_CACHE_DIR):
+		self.connection = connection
+		self.database_dir = database_dir
+		self.summaries = summaries
+		self.cache_dir = cache_dir
+		# The database is a scratch copy of the export, removed with this object (or at exit)
+		self.finalizer = weakref.finalize(self, remove_database, connection, database_dir)
+
+	@classmethod
+	def load (cls, export_dir=DEFAULT_EXPORT_DIR, cache_dir=DEFAULT_CACHE_DIR, incremental=False, bounds=(None, None), instrumentation=None, memory_limit=None):
+		# bounds are ignored: the whole export is cleaned once (same as the pandas path with parquet), and every report pushes its own bounds into its queries
+		if not has_duckdb:
+			raise RuntimeError('The duckdb backend needs the duckdb package (pip install duckdb)')
+		if incremental:
+			raise ValueError('Incremental runs are only supported by the pandas backend')
+		if instrumentation is None: instrumentation = Instrumentation()
+		database_dir = tempfile.mkdtemp(prefix='analytics-duckdb-')
+		config = {'temp_directory': os.path.join(database_dir, 'spill'), 'preserve_insertion_order': True}
+		if memory_limit: config['memory_limit'] = memory_limit
+		connection = duckdb.connect(os.path.join(database_dir, 'export.duckdb'), config=config)
+		data = cls(connection, database_dir, {}, cache_dir)
+		dataset = ExportDataset(export_dir) if is_dataset(export_dir) else None
+		for table in EXPORT_TABLES:
+			with instrumentation.stage(f'Load {table} (duckdb)') as record:
+				if dataset:
+					data.load_dataset_table(dataset, table)
+				else:
+					data.load_table(export_csv_path(export_dir, table), table)
+				record['rows_in'] = record['rows_out'] = data.summaries[table].rows
+		with instrumentation.stage('Clean (duckdb)') as record:
+			data.clean()
+			record['rows_out'] = sum(data.scalar(f'SELECT count(*) FROM {table}') for table in CLEANED_TABLES)
+		return data
+
+	def close (self):
+		self.finalizer()
+
+	def scalar (self, query, parameters=None):
+		return self.connection.execute(query, parameters or []).fetchone()[0]
+
+	def rows (self, query, parameters=None):
+		return self.connection.execute(query, parameters or []).fetchall()
+
+	def load_table (self, csv_path, table):
+		# rowid of the loaded table is the CSV row order, kept as pos from here on
+		columns = ', '.join(f'CAST({column} AS {SQL_TYPES[dtype]}) AS {column}' for column, dtype in EXPORT_COLUMNS[table].items())
+		self.connection.execute(f"CREATE TABLE {table} AS SELECT {columns} FROM read_csv({sql_string(csv_path)}, header=true, all_varchar=true, nullstr=[{', '.join(map(sql_string, PANDAS_NA_VALUES))}])")
+		rows, earliest, latest = self.rows(f'SELECT count(*), min(created_at), max(created_at) FROM {table}')[0]
+		self.summaries[table] = TableSummary.from_dict({'rows': rows, 'earliest': str(earliest) if earliest else None, 'latest': str(latest) if latest else None})
+
+	def load_dataset_table (self, dataset, table):
+		# The whole table, in the dataset's row order (a dataset built from one export reads back in its CSV order)
+		columns = ', '.join(f'CAST({column} AS {SQL_TYPES[dtype]}) AS {column}' for column, dtype in EXPORT_COLUMNS[table].items())
+		paths = [dataset.partition_path(table, partition) for partition in dataset.partitions(table)]
+		if paths:
+			self.connection.execute(f'CREATE TABLE {table} AS SELECT {columns} FROM read_parquet([{', '.join(map(sql_string, paths))}]) ORDER BY {ROW_COLUMN}')
+		else:
+			self.connection.execute(f'CREATE TABLE {table} ({', '.join(f'{column} {SQL_TYPES[dtype]}' for column, dtype in EXPORT_COLUMNS[table].items())})')
+		self.summaries[table] = dataset.summary(table)
+
+	def clean (self):
+		# The same rules as cleaning.cleaning_stages, over the whole export
+		execute = self.connection.execute
+		execute(f'CREATE TABLE dev_sessions AS SELECT DISTINCT session_id FROM session_data WHERE {cleaning.DEV_SESSION_SQL}')
+		execute(f'''CREATE TABLE bad_we_rows AS SELECT visit_id, event_id FROM website_event WHERE
+			created_at < {sql_timestamp(cleaning.ANALYTICS_ADDED_TS)} OR session_id IN (SELECT session_id FROM dev_sessions)''')
+		execute('CREATE TABLE bad_we_visits AS SELECT DISTINCT visit_id FROM bad_we_rows')
+		execute('CREATE TABLE bad_we_events AS SELECT DISTINCT event_id FROM bad_we_rows')
+		# First notes-updated length event of every (session, length), like drop_duplicates()
+		execute('''CREATE TABLE valid_notes_updated_events AS SELECT event_id FROM (
+			SELECT event_id, row_number() OVER (PARTITION BY session_id, string_value ORDER BY rowid) AS occurrence FROM event_data
+			WHERE event_name = 'notes-updated' AND data_key = 'length'
+		) WHERE occurrence = 1''')
+		# Spam: a row no later than the threshold after the previous row of its group (ties in time keep row order, like spam.SessionOrder)
+		execute(f'CREATE TABLE spam_events AS {self.spam_query('event_data', cleaning.EVENT_SPAM_GROUP_COLUMNS, cleaning.event_spam_threshold)}')
+		execute(f"CREATE TABLE spam_view_events AS {self.spam_query('website_event', cleaning.VIEW_SPAM_GROUP_COLUMNS, cleaning.view_spam_threshold, 'event_type != 2')}")
+		overfired = f"NOT coalesce(event_name = 'notes-updated' AND created_at < {sql_timestamp(cleaning.NOTES_UPDATED_OVERFIRE_FIXED_TS)} AND {not_in('event_id', 'valid_notes_updated_events')}, false)"
+		execute(f'CREATE TABLE user_sessions AS SELECT rowid AS pos, * FROM session_data WHERE {not_in('session_id', 'dev_sessions')} ORDER BY pos')
+		execute(f'''CREATE TABLE user_we_events AS SELECT rowid AS pos, * FROM website_event WHERE
+			{not_in('visit_id', 'bad_we_visits')} AND {overfired} AND {not_in('event_id', 'spam_events')} AND {not_in('event_id', 'spam_view_events')} ORDER BY pos''')
+		execute(f'''CREATE TABLE valid_ed_events AS SELECT rowid AS pos, * FROM event_data WHERE
+			{overfired} AND {not_in('event_id', 'bad_we_events')} AND {not_in('event_id', 'spam_events')} ORDER BY pos''')
+
+	def spam_query (self, table, group_columns, threshold, condition=None):
+		partition = ', '.join(group_columns)
+		keys_present = ' AND '.join(f'{column} IS NOT NULL' for column in group_columns)
+		return f'''SELECT DISTINCT event_id FROM (
+			SELECT *, epoch_us(created_at) - lag(epoch_us(created_at)) OVER (PARTITION BY {partition} ORDER BY created_at, rowid) AS since_previous FROM {table}
+		) WHERE since_previous <= {int(threshold.value // 1000)} AND {keys_present}{f' AND {condition}' if condition else ''}'''
+
+	def last_record (self):
+		return max(nullable_timestamp(self.scalar(f'SELECT max(created_at) FROM {table}')) for table in CLEANED_TABLES)
+
+	def report (self, start_bound=None, end_bound=None, sections=None, instrumentation=None, workers=1):
+		# workers is accepted for the same signature; DuckDB already runs every query on all cores
+		if instrumentation is None: instrumentation = Instrumentation()
+		window = DuckDBWindow(self, start_bound, end_bound)
+		results = {}
+		for section in (report.report_sections if sections is None else sections):
+			if section.name not in duckdb_sections:
+				raise ValueError(f'The duckdb backend has no query for the {section.name!r} section')
+			with instrumentation.stage(f'Section: {section.name}'):
+				results[section.name] = duckdb_sections[section.name](window)
+		return results
+
+	def report_series (self, windows, sections=None, instrumentation=None, workers=1):
+		return [(start_bound, end_bound, self.report(start_bound, end_bound, sections, instrumentation, workers)) for start_bound, end_bound in windows]
+
+class DuckDBWindow:
+	# One pair of bounds over the cleaned tables; tables (user_sessions, user_we_events, valid_ed_events) are views of the rows inside them
+	def __init__ (self, data, start_bound, end_bound):
+		self.data = data
+		self.start_bound = start_bound
+		self.end_bound = end_bound
+		conditions = [condition for condition in (
+			f'created_at > {sql_timestamp(start_bound)}' if start_bound else None,
+			f'created_at < {sql_timestamp(end_bound)}' if end_bound else None,
+		) if condition]
+		where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+		for table in CLEANED_TABLES:
+			data.connection.execute(f'CREATE OR REPLACE TEMP VIEW window_{table} AS SELECT * FROM {table}{where}')
+		# unique() counts a missing session_id as one more value
+		self.total_user_sessions = data.scalar('SELECT count(DISTINCT session_id) + (count(*) FILTER (WHERE session_id IS NULL) > 0)::INTEGER FROM window_user_we_events')
+
+	def scalar (self, query):
+		return self.data.scalar(query)
+
+	def rows (self, query):
+		return self.data.rows(query)
+
+def compute_overview (window):
+	summaries = window.data.summaries
+	sd_summary, we_summary, ed_summary = summaries['session_data'], summaries['website_event'], summaries['event_data']
+	total_records = ed_summary.rows + sd_summary.rows + we_summary.rows
+	used = {table: [nullable_timestamp(value) for value in window.rows(f'SELECT count(*), min(created_at), max(created_at) FROM window_{table}')[0][1:]] for table in CLEANED_TABLES}
+	return {
+		'generated_at': datetime.now(UTC).strftime(UMAMI_TIMESTAMP_FORMAT),
+		'earliest_record': min(ed_summary.earliest, sd_summary.earliest, we_summary.earliest),
+		'latest_record': min(ed_summary.latest, sd_summary.latest, we_summary.latest),
+		'start_bound': window.start_bound,
+		'end_bound': window.end_bound,
+		'total_records': total_records,
+		'total_valid_records': sum(window.scalar(f'SELECT count(*) FROM window_{table}') for table in ('valid_ed_events', 'user_sessions', 'user_we_events')),
+		'earliest_used_record': min(used['valid_ed_events'][0], used['user_sessions'][0], used['user_we_events'][0]),
+		'latest_used_record': max(used['valid_ed_events'][1], used['user_sessions'][1], used['user_we_events'][1]),
+	}
+
+def compute_users (window):
+	# Countries in order of first appearance, counting every (session, country) pair once; a missing country gets a count of 0, as in report.compute_users()
+	country_counts = window.rows('''SELECT country, CASE WHEN country IS NULL THEN 0 ELSE count(*) END FROM (
+		SELECT session_id, country, min(pos) AS first_pos FROM window_user_we_events GROUP BY session_id, country
+	) GROUP BY country ORDER BY min(first_pos)''')
+	country_names = resolve_country_names([country_code for country_code, _ in country_counts], os.path.join(window.data.cache_dir, 'country_names.json'))
+	return {
+		'total_user_sessions': window.total_user_sessions,
+		'countries': [[country_name, int(country_count)] for country_name, (_, country_count) in zip(country_names, country_counts)],
+		'total_user_visits': window.scalar('SELECT count(*) FROM (SELECT DISTINCT session_id, visit_id FROM window_user_we_events)'),
+		'total_user_views': window.scalar('SELECT count(*) FROM window_user_we_events WHERE event_type = 1'),
+	}
+
+def compute_repeat_visitors (window):
+	per_session = window.rows('''WITH
+		visits AS (SELECT session_id, count(*) AS visits FROM (SELECT DISTINCT session_id, visit_id FROM window_user_we_events) WHERE session_id IS NOT NULL GROUP BY session_id),
+		first_rows AS (SELECT first(session_id ORDER BY pos) AS session_id FROM window_user_we_events GROUP BY event_id),
+		events AS (SELECT session_id, count(*) AS events FROM first_rows WHERE session_id IS NOT NULL GROUP BY session_id)
+	SELECT visits.visits, coalesce(events.events, 0) FROM visits LEFT JOIN events USING (session_id)''')
+	counts = np.array(per_session, dtype='int64').reshape(-1, 2)
+	return report.bucket_repeat_visitors(counts[:, 0], counts[:, 1])
+
+def unique_values_per_group (window, group_column, value_column, keep_missing_values):
+	# groupby(group_column)[value_column].unique().explode().value_counts(): groups in sorted order, values in order of appearance within them,
+	# so ties between equally common values go to whichever shows up first in the lowest group
+	return window.rows(f'''SELECT {value_column}, count(*) AS groups FROM (
+		SELECT {group_column}, {value_column}, min(pos) AS first_pos FROM window_user_we_events
+		WHERE {group_column} IS NOT NULL{'' if keep_missing_values else f' AND {value_column} IS NOT NULL'}
+		GROUP BY {group_column}, {value_column}
+	) GROUP BY {value_column} ORDER BY groups DESC, min({group_column}), first(first_pos ORDER BY {group_column})''')
+
+def compute_devices (window):
+	return {
+		'total_user_sessions': window.total_user_sessions,
+		'devices': [[device, int(count)] for device, count in unique_values_per_group(window, 'session_id', 'device', keep_missing_values=False)],
+	}
+
+def compute_referrals (window):
+	return {
+		'total_user_sessions': window.total_user_sessions,
+		'referrers': report.combine_referrers((np.nan if referrer is None else referrer, count) for referrer, count in unique_values_per_group(window, 'visit_id', 'referrer_domain', keep_missing_values=True)),
+	}
+
+def compute_events_overview (window):
+	# Named events per session, counting each event_id's first row once (like drop_duplicates('event_id'))
+	counts = window.rows('''SELECT count(event_name) FROM (
+		SELECT first(session_id ORDER BY pos) AS session_id, first(event_name ORDER BY pos) AS event_name FROM window_valid_ed_events GROUP BY event_id
+	) WHERE session_id IS NOT NULL GROUP BY session_id''')
+	return report.summarize_events_per_user(np.array([count for count, in counts], dtype='int64'), window.total_user_sessions)
+
+def compute_events_in_detail (window):
+	event_counts_by_name = [(name, count) for name, count in window.rows('''SELECT event_name, count(DISTINCT event_id) AS events FROM window_valid_ed_events
+		WHERE event_name IS NOT NULL GROUP BY event_name ORDER BY events DESC, min(pos)''')]
+	nkv_rows = window.rows('''SELECT event_name, data_key, string_value, count(DISTINCT event_id), count(*) AS value_rows FROM window_valid_ed_events
+		WHERE event_name IS NOT NULL AND data_key IS NOT NULL AND string_value IS NOT NULL
+		GROUP BY event_name, data_key, string_value ORDER BY value_rows DESC, min(pos)''')
+	unique_events_by_nkv = {(name, key, value): unique_events for name, key, value, unique_events, _ in nkv_rows}
+	values_by_nk = {}
+	for name, key, value, _, value_rows in nkv_rows:
+		values_by_nk.setdefault((name, key), []).append([value, value_rows])
+	max_value_by_nk = {(name, key): (np.nan if max_value is None else max_value) for name, key, max_value in window.rows('''SELECT event_name, data_key, max(string_value) FROM window_valid_ed_events
+		WHERE event_name IS NOT NULL AND data_key IS NOT NULL GROUP BY event_name, data_key''')}
+	return report.describe_events(report.EventDetailIndex(event_counts_by_name, unique_events_by_nkv, values_by_nk, max_value_by_nk))
+
+duckdb_sections = {
+	'overview': compute_overview,
+	'users': compute_users,
+	'repeat_visitors': compute_repeat_visitors,
+	'devices': compute_devices,
+	'referrals': compute_referrals,
+	'events_overview': compute_events_overview,
+	'events_in_detail': compute_events_in_detail,
+}
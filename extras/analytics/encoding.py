@@ -0,0 +1,120 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+# Umami ids are 36-character UUID strings; the rows kept after windowing get them replaced with dense int32 codes so joins and membership tests work on integers/bitmaps
+# Ids only seen in rows outside the window never get a code, so the vocabularies grow with the window, not with the export
+# A missing id is encoded as -1 and stays -1 through finalize(); mask() and decode() leave room for it, so it never stands for a real id
+ID_COLUMNS = {
+	'session_id': 'session',
+	'visit_id': 'visit',
+	'event_id': 'event',
+}
+
+class IdVocabulary:
+	# Codes are handed out in order of first appearance while the kept rows stream in, then finalize() renumbers them so they sort the same way the UUID strings did
+	# (groupby/sort output order then matches what the report printed back when ids were strings)
+	def __init__ (self):
+		self.codes_by_id = {}
+		self.loaded = 0
+		self.labels = None
+		self.ranks = None
+		self.order = None
+
+	@classmethod
+	def from_labels (cls, labels):
+		# Picks up where an earlier vocabulary left off: the given labels (in provisional order) keep their codes, new ones are appended
+		vocabulary = cls()
+		vocabulary.codes_by_id = {label: code for code, label in enumerate(labels)}
+		vocabulary.loaded = len(labels)
+		return vocabulary
+
+	def __len__ (self):
+		return len(self.codes_by_id) if self.labels is None else len(self.labels)
+
+	def encode (self, values):
+		# Only the distinct ids of each chunk go through the dict, the rest is vectorized
+		chunk_codes, uniques = pd.factorize(values)
+		codes_by_id = self.codes_by_id
+		mapped = np.fromiter((codes_by_id.setdefault(value, len(codes_by_id)) for value in uniques), dtype='int32', count=len(uniques))
+		if (chunk_codes < 0).any():
+			return np.where(chunk_codes < 0, -1, mapped[chunk_codes]).astype('int32')
+		return mapped[chunk_codes]
+
+	def finalize (self):
+		labels = np.array(list(self.codes_by_id), dtype=object)
+		self.order = np.argsort(labels, kind='stable').astype('int32')
+		self.ranks = np.empty(len(labels), dtype='int32')
+		self.ranks[self.order] = np.arange(len(labels), dtype='int32')
+		self.labels = labels[self.order]
+
+	def renumber (self, codes):
+		# Provisional (first appearance) codes -> final (sorted) codes
+		codes = np.asarray(codes, dtype='int64')
+		return np.where(codes < 0, -1, self.ranks[codes]).astype('int32')
+
+	def provisional (self, codes):
+		# Final codes -> provisional ones, which stay valid for a vocabulary rebuilt with from_labels(provisional_labels())
+		codes = np.asarray(codes, dtype='int64')
+		return np.where(codes < 0, -1, self.order[codes]).astype('int32')
+
+	def provisional_labels (self, added_only=False):
+		# Labels in provisional order, or only those added since from_labels()
+		return np.array(list(itertools.islice(self.codes_by_id, self.loaded if added_only else 0, None)), dtype=object)
+
+	def codes (self, ids):
+		# Final codes of those of the given ids (e.g. a set collected from the whole export) that are in the vocabulary; the others can't match any kept row
+		codes = pd.Index(self.labels).get_indexer(np.array(list(ids), dtype=object))
+		return codes[codes >= 0]
+
+	def mask (self, codes):
+		# Bitmap over the whole vocabulary; use as mask[frame[column].to_numpy()] in place of isin()
+		# One extra entry at the end is always False, so a missing id (-1) is never in the mask
+		mask = np.zeros(len(self) + 1, dtype=bool)
+		codes = np.asarray(codes, dtype='int64')
+		mask[codes[codes >= 0]] = True
+		return mask
+
+	def decode (self, codes):
+		codes = np.asarray(codes, dtype='int64')
+		return np.where(codes < 0, None, self.labels[codes])
+
+class ExportIds:
+	# One vocabulary per kind of id, shared by every table so codes line up across session_data, website_event and event_data
+	def __init__ (self):
+		self.session = IdVocabulary()
+		self.visit = IdVocabulary()
+		self.event = IdVocabulary()
+
+	@classmethod
+	def from_labels (cls, labels_by_kind):
+		export_ids = cls()
+		for kind, labels in labels_by_kind.items():
+			setattr(export_ids, kind, IdVocabulary.from_labels(labels))
+		return export_ids
+
+	def provisional_labels (self, added_only=False):
+		return {kind: getattr(self, kind).provisional_labels(added_only) for kind in ID_COLUMNS.values()}
+
+	def vocabulary (self, column):
+		return getattr(self, ID_COLUMNS[column])
+
+	def encode_frame (self, frame):
+		for column in ID_COLUMNS:
+			if column in frame.columns:
+				frame[column] = self.vocabulary(column).encode(frame[column].to_numpy())
+		return frame
+
+	def provisional_frame (self, frame):
+		# Copy of a frame with final codes, with provisional ones instead (see IdVocabulary.provisional())
+		return frame.assign(**{column: self.vocabulary(column).provisional(frame[column].to_numpy()) for column in ID_COLUMNS if column in frame.columns})
+
+	def finalize (self, *frames):
+		# Call once every table is loaded; renumbers the id columns of the given frames in place
+		self.session.finalize()
+		self.visit.finalize()
+		self.event.finalize()
+		for frame in frames:
+			for column in ID_COLUMNS:
+				if column in frame.columns:
+					frame[column] = self.vocabulary(column).renumber(frame[column].to_numpy())
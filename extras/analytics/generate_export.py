@@ -0,0 +1,189 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from .report import event_name_map
+from .cleaning import ANALYTICS_ADDED_TS
+
+# Writes a synthetic Umami export (session_data.csv, website_event.csv, event_data.csv) with the same columns as a real one, for benchmarking
+# Sessions are generated in batches with numpy and appended to the CSVs, so memory stays flat from 10k up to tens of millions of rows
+# Distributions are rough guesses shaped like the real export: most people visit once, a few come back a lot, a few sessions are developers,
+# some events/views come in spam bursts (within the spam thresholds), and every event name in event_name_map shows up with the data keys the report looks at
+
+SESSION_DATA_COLUMNS = ['website_id', 'session_id', 'data_key', 'string_value', 'number_value', 'date_value', 'data_type', 'created_at', 'distinct_id', 'job_id']
+WEBSITE_EVENT_COLUMNS = ['website_id', 'session_id', 'visit_id', 'event_id', 'hostname', 'browser', 'os', 'device', 'screen', 'language', 'country', 'region', 'city', 'url_path', 'url_query', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term', 'referrer_path', 'referrer_query', 'referrer_domain', 'page_title', 'gclid', 'fbclid', 'msclkid', 'ttclid', 'li_fat_id', 'twclid', 'event_type', 'event_name', 'tag', 'distinct_id', 'created_at', 'job_id']
+EVENT_DATA_COLUMNS = ['website_id', 'session_id', 'event_id', 'url_path', 'event_name', 'data_key', 'string_value', 'number_value', 'date_value', 'data_type', 'created_at', 'job_id']
+WEBSITE_ID = '6f1c7a52-7e0b-4d43-9a0e-2d5f0b8a9c11'
+
+# event name -> (relative frequency, data key, possible values); notes-updated values are note lengths, generated separately
+EVENT_DATA = {
+	'sidebar-page-navigated': (30, 'page', ['home', 'school', 'schedules', 'settings', 'about', 'credits']),
+	'setting-changed': (18, 'setting', ['font', 'backgroundTheme', 'hourFormat', 'themeUnderlay', 'foregroundTheme', 'clockSeconds']),
+	'sidebar-toggled': (16, 'isOpenNow', ['true', 'false']),
+	'notes-updated': (12, 'length', None),
+	'school-selected': (8, 'schoolId', ['1', '3', '4', '2', '-1', '-2']),
+	'timer-used': (7, 'event', ['start', 'stop', 'mute', 'unmute', 'reset']),
+	'stopwatch-used': (6, 'event', ['start', 'stop', 'reset']),
+	'simulated-fullscreen-entered': (5, 'id', ['time', 'timeLeft', 'timeOver', 'schedule']),
+	'simulated-fullscreen-exited': (4, 'id', ['time', 'timeLeft', 'timeOver', 'schedule']),
+	'notes-toggled': (4, 'newState', ['open', 'closed']),
+	'timer-toggled': (3, 'newState', ['open', 'closed']),
+	'stopwatch-toggled': (3, 'newState', ['open', 'closed']),
+	'toggle-fullscreen-clicked': (3, 'attemptedNewState', ['fullscreen', 'no-fullscreen']),
+	'school-name-clicked': (2, 'alreadySelected', ['true', 'false']),
+	'division-selected': (2, 'divisionLabel', ['Period 1', 'Period 2', 'Period 3', 'Lunch']),
+	'get-pwa-clicked': (1, 'outcome', ['dismissed', 'accepted']),
+}
+assert set(EVENT_DATA) == set(event_name_map), 'every event in the report needs synthetic data'
+
+COUNTRIES = (['US', 'GB', 'IN', 'CA', 'AU', 'DE', 'PH', 'BR'], [70, 6, 8, 5, 3, 2, 3, 3])
+DEVICES = (['mobile', 'laptop', 'desktop', 'tablet'], [45, 35, 15, 5])
+REFERRERS = ([None, 'siege.hackclub.com', 'com.slack', 'l.instagram.com', 'google.com', 'github.com', 'classroom.google.com', 'example.org'], [60, 10, 8, 6, 8, 3, 4, 1])
+SCHOOL_IDS = (['1', '2', '3', '4'], [50, 10, 30, 10])
+
+DEV_SESSION_SHARE = 0.03
+PROFILE_SESSION_SHARE = 0.01
+SCHOOL_SESSION_SHARE = 0.4
+SPAM_BURST_SHARE = 0.03 # share of events/views repeated in a burst that the spam filters should drop
+SESSIONS_PER_BATCH = 20000
+
+UUID_HEX_POSITIONS = [position for position in range(36) if position not in (8, 13, 18, 23)]
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype='uint8')
+
+def random_uuids (rng, count):
+	chars = np.full((count, 36), ord('-'), dtype='uint8')
+	chars[:, UUID_HEX_POSITIONS] = HEX_DIGITS[rng.integers(0, 16, size=(count, 32), dtype='uint8')]
+	return chars.view('S36').ravel().astype(str)
+
+def choose (rng, options, count):
+	values, weights = options
+	weights = np.asarray(weights, dtype=float)
+	return np.asarray(values, dtype=object)[rng.choice(len(values), size=count, p=weights / weights.sum())]
+
+def offsets_within_groups (gaps, counts):
+	# Per-row running total of gaps inside each group (the first row of a group gets 0), for groups of consecutive rows with the given sizes
+	totals = np.cumsum(gaps) - gaps
+	counts = counts[counts > 0]
+	return totals - np.repeat(totals[np.cumsum(counts) - counts], counts)
+
+def spam_bursts (rng, count):
+	# How many times each row is repeated: mostly once, a few times 2-4 times in a burst
+	repeats = np.ones(count, dtype='int64')
+	bursts = rng.random(count) < SPAM_BURST_SHARE
+	repeats[bursts] = rng.integers(2, 5, size=int(bursts.sum()))
+	return repeats
+
+def generate_batch (rng, session_count, start, seconds_range):
+	# Returns (session_data, website_event, event_data) frames for session_count new sessions
+	session_ids = random_uuids(rng, session_count)
+	session_starts = start + pd.to_timedelta(rng.integers(0, seconds_range, size=session_count), unit='s').to_numpy()
+	is_dev = rng.random(session_count) < DEV_SESSION_SHARE
+	session_devices = choose(rng, DEVICES, session_count)
+	session_countries = choose(rng, COUNTRIES, session_count)
+	engagement = rng.lognormal(0, 0.8, size=session_count) # a few heavy users do most of the events
+
+	# Session data: every session says which env it's from, some have a test profile or a school
+	has_profile = rng.random(session_count) < PROFILE_SESSION_SHARE
+	has_school = rng.random(session_count) < SCHOOL_SESSION_SHARE
+	session_data = pd.DataFrame({
+		'session_id': np.concatenate([session_ids, session_ids[has_profile], session_ids[has_school]]),
+		'data_key': np.concatenate([np.full(session_count, 'env', dtype=object), np.full(int(has_profile.sum()), 'profile', dtype=object), np.full(int(has_school.sum()), 'schoolId', dtype=object)]),
+		'string_value': np.concatenate([np.where(is_dev, 'dev', 'prod').astype(object), np.full(int(has_profile.sum()), 'test-device', dtype=object), choose(rng, SCHOOL_IDS, int(has_school.sum()))]),
+		'created_at': np.concatenate([session_starts, session_starts[has_profile], session_starts[has_school]]),
+	})
+
+	# Visits: most sessions visit once, some come back every day or two
+	visit_counts = np.minimum(rng.geometric(0.55, size=session_count), 16)
+	visit_sessions = np.repeat(np.arange(session_count), visit_counts)
+	visit_count = len(visit_sessions)
+	visit_gaps = rng.exponential(36 * 3600, size=visit_count).astype('int64')
+	visit_starts = session_starts[visit_sessions] + pd.to_timedelta(offsets_within_groups(visit_gaps, visit_counts), unit='s').to_numpy()
+	visit_ids = random_uuids(rng, visit_count)
+	visit_referrers = choose(rng, REFERRERS, visit_count)
+
+	# Page views (event_type 1): a few per visit, some reloaded in quick succession
+	view_counts = 1 + rng.poisson(0.8, size=visit_count)
+	view_visits = np.repeat(np.arange(visit_count), view_counts)
+	view_repeats = spam_bursts(rng, len(view_visits))
+	view_visits = np.repeat(view_visits, view_repeats)
+	view_gaps = np.where(np.repeat(view_repeats > 1, view_repeats), rng.integers(0, 10, size=len(view_visits)), rng.exponential(90, size=len(view_visits)).astype('int64'))
+	view_times = visit_starts[view_visits] + pd.to_timedelta(offsets_within_groups(view_gaps, np.bincount(view_visits, minlength=visit_count)), unit='s').to_numpy()
+
+	# Custom events (event_type 2): how many depends on the session's engagement; some fire several times within a second
+	event_counts = rng.poisson(3 * engagement[visit_sessions])
+	event_visits = np.repeat(np.arange(visit_count), event_counts)
+	names = np.array(list(EVENT_DATA), dtype=object)
+	frequencies = np.array([frequency for frequency, _, _ in EVENT_DATA.values()], dtype=float)
+	event_names = names[rng.choice(len(names), size=len(event_visits), p=frequencies / frequencies.sum())]
+	event_keys = np.empty(len(event_visits), dtype=object)
+	event_values = np.empty(len(event_visits), dtype=object)
+	for name, (_, key, values) in EVENT_DATA.items():
+		is_name = (event_names == name)
+		event_keys[is_name] = key
+		if values is None:
+			event_values[is_name] = rng.lognormal(4, 1.2, size=int(is_name.sum())).astype('int64').astype(str)
+		else:
+			event_values[is_name] = choose(rng, (values, np.arange(len(values), 0, -1)), int(is_name.sum()))
+	event_repeats = spam_bursts(rng, len(event_visits))
+	event_visits, event_names, event_keys, event_values = (np.repeat(column, event_repeats) for column in (event_visits, event_names, event_keys, event_values))
+	event_gaps = np.where(np.repeat(event_repeats > 1, event_repeats), rng.integers(0, 2, size=len(event_visits)), rng.exponential(45, size=len(event_visits)).astype('int64'))
+	event_times = visit_starts[event_visits] + pd.to_timedelta(offsets_within_groups(event_gaps, np.bincount(event_visits, minlength=visit_count)), unit='s').to_numpy()
+	event_ids = random_uuids(rng, len(event_visits))
+
+	website_event = pd.DataFrame({
+		'session_id': session_ids[visit_sessions[np.concatenate([view_visits, event_visits])]],
+		'visit_id': visit_ids[np.concatenate([view_visits, event_visits])],
+		'event_id': np.concatenate([random_uuids(rng, len(view_visits)), event_ids]),
+		'device': session_devices[visit_sessions[np.concatenate([view_visits, event_visits])]],
+		'country': session_countries[visit_sessions[np.concatenate([view_visits, event_visits])]],
+		'referrer_domain': visit_referrers[np.concatenate([view_visits, event_visits])],
+		'event_type': np.concatenate([np.ones(len(view_visits), dtype='int64'), np.full(len(event_visits), 2, dtype='int64')]),
+		'event_name': np.concatenate([np.full(len(view_visits), None, dtype=object), event_names]),
+		'created_at': np.concatenate([view_times, event_times]),
+	})
+	event_data = pd.DataFrame({
+		'session_id': session_ids[visit_sessions[event_visits]],
+		'event_id': event_ids,
+		'event_name': event_names,
+		'data_key': event_keys,
+		'string_value': event_values,
+		'created_at': event_times,
+	})
+	return session_data, website_event, event_data
+
+def fill_columns (frame, columns):
+	# Adds the columns the report never reads, with constant or empty values, in export column order
+	constants = {'website_id': WEBSITE_ID, 'hostname': 'timecheck22.example', 'browser': 'chrome', 'os': 'Windows 10', 'screen': '1920x1080', 'language': 'en-US', 'url_path': '/', 'page_title': 'TimeCheck 22', 'data_type': 1}
+	for column in columns:
+		if column not in frame.columns:
+			frame[column] = constants.get(column)
+	return frame[columns]
+
+def generate_export (output_dir, rows, seed=0, start='2025-12-01', end='2026-01-25'):
+	# Generates sessions until the three tables have at least rows rows in total; returns {table: row count}
+	rng = np.random.default_rng(seed)
+	os.makedirs(output_dir, exist_ok=True)
+	start, end = np.datetime64(pd.Timestamp(start), 's'), np.datetime64(pd.Timestamp(end), 's')
+	seconds_range = int((end - start) / np.timedelta64(1, 's'))
+	tables = {'session_data': SESSION_DATA_COLUMNS, 'website_event': WEBSITE_EVENT_COLUMNS, 'event_data': EVENT_DATA_COLUMNS}
+	row_counts = dict.fromkeys(tables, 0)
+	session_count = min(SESSIONS_PER_BATCH, max(10, rows // 40))
+	while sum(row_counts.values()) < rows:
+		for (table, columns), frame in zip(tables.items(), generate_batch(rng, session_count, start, seconds_range)):
+			fill_columns(frame, columns).to_csv(os.path.join(output_dir, table + '.csv'), mode=('a' if row_counts[table] else 'w'), header=(not row_counts[table]), index=False, date_format='%Y-%m-%d %H:%M:%S')
+			row_counts[table] += len(frame)
+	return row_counts
+
+def main (argv=None):
+	parser = argparse.ArgumentParser(description='Writes a synthetic Umami export for benchmarking the analytics report.')
+	parser.add_argument('output_dir', help='where to write session_data.csv, website_event.csv and event_data.csv')
+	parser.add_argument('--rows', type=int, default=100000, help='total rows over all three tables, roughly (default: 100000)')
+	parser.add_argument('--seed', type=int, default=0, help='random seed; the same seed and rows give the same export (default: 0)')
+	parser.add_argument('--start', default='2025-12-01', help='earliest session start (default: 2025-12-01, before analytics were added on ' + ANALYTICS_ADDED_TS + ')')
+	parser.add_argument('--end', default='2026-01-25', help='latest session start (default: 2026-01-25)')
+	args = parser.parse_args(argv)
+	row_counts = generate_export(args.output_dir, args.rows, args.seed, args.start, args.end)
+	print(', '.join(f'{table}: {count} rows' for table, count in row_counts.items()))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+from .encoding import ExportIds, ID_COLUMNS
+from .ingest import EXPORT_TABLES, TableSummary, concat_frames, export_csv_path
+from .cleaning import EVENT_SPAM_GROUP_COLUMNS, VIEW_SPAM_GROUP_COLUMNS, ExportFacts, constants_digest
+from .spam import merge_tails
+
+# Incremental mode keeps what a full run would need to pick up where it left off, given newer exports that are the last ones with rows appended:
+#  - how far each export CSV was read (its size then) and a digest of those bytes, so one hash of the new file proves it starts with the old one, and parsing can start right past it
+#  - the cleaned frames (not per-section aggregates, since a newly seen dev session can still remove older rows)
+#  - the whole-export facts cleaning decides from (cleaning.ExportFacts), so rows read later are judged the same as in a full run
+#  - the id vocabularies, so old and new rows get the same codes
+#  - the spam filters' tail state, i.e. the latest created_at of every group they diff over
+# Every run only adds a part with what it read: the rows it cleaned, the tail rows it updated, the ids and facts it found; meta.json lists the parts, and is written last
+# Frames are stored with provisional id codes (see encoding.IdVocabulary.provisional()), which don't change when later runs add ids
+# Needs parquet (pyarrow), same as the cleaned frame cache
+STATE_FORMAT_VERSION = 2
+CLEANED_FRAMES = ('user_sessions', 'user_we_events', 'valid_ed_events')
+SPAM_TAILS = {'event_spam_tail': EVENT_SPAM_GROUP_COLUMNS, 'view_spam_tail': VIEW_SPAM_GROUP_COLUMNS}
+STATE_FRAMES = CLEANED_FRAMES + tuple(SPAM_TAILS)
+META_FILE_NAME = 'meta.json'
+# Past this many parts, the next save writes the whole state as one part again
+MAX_STATE_PARTS = 16
+HASH_BLOCK_SIZE = 1 << 20
+
+class ExportFile:
+	# How much of an export CSV has been read: its first offset bytes, their sha256, and the TableSummary of the rows in them
+	def __init__ (self, offset, digest, summary=None):
+		self.offset = offset
+		self.digest = digest
+		self.summary = summary
+
+	@classmethod
+	def read (cls, csv_path, summary=None):
+		hasher = hashlib.sha256()
+		offset = 0
+		with open(csv_path, 'rb') as csv_file:
+			while block := csv_file.read(HASH_BLOCK_SIZE):
+				hasher.update(block)
+				offset += len(block)
+		return cls(offset, hasher.hexdigest(), summary)
+
+	def appended (self, csv_path):
+		# The ExportFile for csv_path as it is now (without a summary yet), if it's this one with rows appended; None if not
+		# Both digests come from one pass over the file: the old one is checked as soon as the old end is reached
+		hasher = hashlib.sha256()
+		position = 0
+		last_byte = b'\n'
+		with open(csv_path, 'rb') as csv_file:
+			while position < self.offset and (block := csv_file.read(min(HASH_BLOCK_SIZE, self.offset - position))):
+				hasher.update(block)
+				position += len(block)
+				last_byte = block[-1:]
+			if position < self.offset or hasher.hexdigest() != self.digest: return None
+			# The old file may have ended without a line break; then the first appended byte has to be one, or its last row was changed
+			if last_byte not in (b'\n', b'\r') and csv_file.read(1) not in (b'', b'\n', b'\r'): return None
+			csv_file.seek(position)
+			while block := csv_file.read(HASH_BLOCK_SIZE):
+				hasher.update(block)
+				position += len(block)
+		return ExportFile(position, hasher.hexdigest())
+
+	def to_dict (self):
+		return {'offset': self.offset, 'digest': self.digest, 'summary': self.summary.to_dict()}
+
+	@classmethod
+	def from_dict (cls, data):
+		return cls(data['offset'], data['digest'], TableSummary.from_dict(data['summary']))
+
+class IncrementalState:
+	def __init__ (self, frames, export_ids, facts, files, constants, parts=(), added_frames=None):
+		self.frames = frames # every frame in STATE_FRAMES, with final codes once export_ids is finalized
+		self.export_ids = export_ids
+		self.facts = facts
+		self.files = files # {table: ExportFile}
+		self.constants = constants
+		self.parts = list(parts)
+		self.added_frames = added_frames # what this run added to frames, i.e. what save() writes as a new part; None writes everything anew
+
+	@classmethod
+	def fresh (cls, export_dir, frames, export_ids, facts, summaries, constants):
+		# State after a full run over export_dir
+		files = {table: ExportFile.read(export_csv_path(export_dir, table), summaries[table]) for table in EXPORT_TABLES}
+		return cls(frames, export_ids, facts, files, constants)
+
+	def appended_files (self, export_dir):
+		# {table: ExportFile} if every export CSV in export_dir is the one read last time with rows appended, else None
+		files = {}
+		for table in EXPORT_TABLES:
+			files[table] = self.files[table].appended(export_csv_path(export_dir, table))
+			if files[table] is None: return None
+		return files
+
+	def precedes (self, summaries):
+		# True if no appended row (summaries only cover those) is older than the latest row read before in its table
+		for table, summary in summaries.items():
+			latest = self.files[table].summary.latest
+			if not pd.isna(latest) and not pd.isna(summary.earliest) and summary.earliest < latest: return False
+		return True
+
+	def advance (self, cleaned_frames, added_frames, summaries, files):
+		# State after this run read the appended rows: added_frames holds the rows it cleaned and the spam tail rows it updated, summaries the whole tables
+		frames = {**cleaned_frames, **{name: merge_tails([self.frames[name], added_frames[name]], group_columns) for name, group_columns in SPAM_TAILS.items()}}
+		for table, export_file in files.items():
+			export_file.summary = summaries[table]
+		return IncrementalState(frames, self.export_ids, self.facts, files, self.constants, self.parts, added_frames)
+
+	def save (self, state_dir):
+		if self.added_frames is None or len(self.parts) >= MAX_STATE_PARTS or not os.path.exists(os.path.join(state_dir, META_FILE_NAME)):
+			# Everything as one part, in a new directory that then replaces the old one
+			temp_dir = state_dir + f'.tmp-{os.getpid()}'
+			shutil.rmtree(temp_dir, ignore_errors=True)
+			self.write_part(temp_dir, '0', self.frames, added_only=False)
+			self.write_meta(temp_dir, ['0'])
+			shutil.rmtree(state_dir, ignore_errors=True)
+			os.replace(temp_dir, state_dir)
+			return
+		# Only a new part; until meta.json lists it, a load ignores it
+		part = str(int(self.parts[-1]) + 1)
+		self.write_part(state_dir, part, self.added_frames, added_only=True)
+		self.write_meta(state_dir, self.parts + [part])
+
+	def write_part (self, state_dir, part, frames, added_only):
+		for name in STATE_FRAMES:
+			self.write_frame(state_dir, 'frames', name, part, self.export_ids.provisional_frame(frames[name]).reset_index(drop=True))
+		for kind, labels in self.export_ids.provisional_labels(added_only).items():
+			self.write_frame(state_dir, 'ids', kind, part, pd.DataFrame({'label': labels}))
+		for name, frame in self.facts.to_frames(added_only).items():
+			self.write_frame(state_dir, 'facts', name, part, frame)
+
+	@staticmethod
+	def write_frame (state_dir, group, name, part, frame):
+		os.makedirs(os.path.join(state_dir, group, name), exist_ok=True)
+		frame.to_parquet(os.path.join(state_dir, group, name, part + '.parquet'), index=False)
+
+	def write_meta (self, state_dir, parts):
+		meta = {
+			'version': STATE_FORMAT_VERSION,
+			'constants': constants_digest(self.constants),
+			'files': {table: export_file.to_dict() for table, export_file in self.files.items()},
+			'parts': parts,
+		}
+		temp_path = os.path.join(state_dir, META_FILE_NAME + f'.tmp-{os.getpid()}')
+		with open(temp_path, 'w') as meta_file:
+			json.dump(meta, meta_file)
+		os.replace(temp_path, os.path.join(state_dir, META_FILE_NAME))
+
+	@classmethod
+	def load (cls, state_dir, constants):
+		# Returns None if there's no usable state (never saved, older format, or the cleaning constants changed since)
+		try:
+			with open(os.path.join(state_dir, META_FILE_NAME)) as meta_file:
+				meta = json.load(meta_file)
+			if meta.get('version') != STATE_FORMAT_VERSION or meta.get('constants') != constants_digest(constants): return None
+			parts = meta['parts']
+			def read_parts (group, name):
+				return [pd.read_parquet(os.path.join(state_dir, group, name, part + '.parquet')) for part in parts]
+			frames = {name: concat_frames(read_parts('frames', name)) for name in CLEANED_FRAMES}
+			frames.update({name: merge_tails(read_parts('frames', name), group_columns) for name, group_columns in SPAM_TAILS.items()})
+			labels = {kind: pd.concat(read_parts('ids', kind), ignore_index=True)['label'].to_numpy(dtype=object) for kind in ID_COLUMNS.values()}
+			facts = ExportFacts.from_frames({name: pd.concat(read_parts('facts', name), ignore_index=True) for name in ExportFacts.FRAME_COLUMNS})
+			files = {table: ExportFile.from_dict(export_file) for table, export_file in meta['files'].items()}
+		except (OSError, ValueError, KeyError):
+			return None
+		return cls(frames, ExportIds.from_labels(labels), facts, files, constants, parts)
@@ -0,0 +1,155 @@
+import csv
+import os
+import pandas as pd
+from .encoding import ID_COLUMNS
+from pandas.api.types import union_categoricals
+
+# Only the columns the report actually uses are read from each Umami export table, with the most compact dtype that keeps the report output unchanged
+# Low-cardinality columns that are only ever compared against literals are categorical; anything that gets value_counts()/unique()'d stays a plain string
+EXPORT_COLUMNS = {
+	'session_data': {
+		'session_id': 'str',
+		'data_key': 'category',
+		'string_value': 'str',
+		'created_at': 'datetime',
+	},
+	'website_event': {
+		'session_id': 'str',
+		'visit_id': 'str',
+		'event_id': 'str',
+		'created_at': 'datetime',
+		'event_type': 'int8',
+		'event_name': 'category',
+		'referrer_domain': 'str',
+		'device': 'str',
+		'country': 'str',
+	},
+	'event_data': {
+		'session_id': 'str',
+		'event_id': 'str',
+		'event_name': 'str',
+		'data_key': 'category',
+		'string_value': 'str',
+		'created_at': 'datetime',
+	},
+}
+EXPORT_TABLES = tuple(EXPORT_COLUMNS)
+DEFAULT_EXPORT_DIR = os.path.join(os.path.dirname(__file__), 'exports/tc22-umami-data-2026-jan-25/')
+UMAMI_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+CSV_CHUNK_ROWS = 100000
+
+class TableSummary:
+	# Whole-table facts gathered while streaming, so callers don't need the unfiltered frame around afterwards
+	def __init__ (self):
+		self.rows = 0
+		self.earliest = pd.NaT
+		self.latest = pd.NaT
+
+	def update (self, chunk):
+		if len(chunk) == 0: return
+		self.add(len(chunk), chunk['created_at'].min(), chunk['created_at'].max())
+
+	def add (self, rows, earliest, latest):
+		self.rows += rows
+		if not pd.isna(earliest): self.earliest = earliest if pd.isna(self.earliest) else min(self.earliest, earliest)
+		if not pd.isna(latest): self.latest = latest if pd.isna(self.latest) else max(self.latest, latest)
+
+	def merge (self, other):
+		# Summary of this table with other's rows appended (e.g. the rows an incremental run read past the previous one)
+		merged = TableSummary()
+		merged.add(self.rows, self.earliest, self.latest)
+		merged.add(other.rows, other.earliest, other.latest)
+		return merged
+
+	def to_dict (self):
+		return {'rows': self.rows, 'earliest': None if pd.isna(self.earliest) else str(self.earliest), 'latest': None if pd.isna(self.latest) else str(self.latest)}
+
+	@classmethod
+	def from_dict (cls, data):
+		summary = cls()
+		summary.rows = data['rows']
+		summary.earliest = pd.Timestamp(data['earliest']) if data['earliest'] else pd.NaT
+		summary.latest = pd.Timestamp(data['latest']) if data['latest'] else pd.NaT
+		return summary
+
+def concat_frames (frames):
+	# pd.concat falls back to object dtype when categorical columns have different categories, so union them by hand
+	non_empty = [frame for frame in frames if len(frame) > 0]
+	if len(non_empty) <= 1:
+		return (non_empty or frames)[0].reset_index(drop=True)
+	frames = non_empty
+	combined = {}
+	for column in frames[0].columns:
+		if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+			# A chunk where the column is all missing has categories of a different dtype, which union_categoricals() refuses
+			categories_dtype = next((frame[column].cat.categories.dtype for frame in frames if len(frame[column].cat.categories) > 0), None)
+			parts = [(frame[column].cat.set_categories(frame[column].cat.categories.astype(categories_dtype)) if categories_dtype is not None else frame[column]) for frame in frames]
+			combined[column] = pd.Series(union_categoricals(parts), name=column)
+		else:
+			combined[column] = pd.concat([frame[column] for frame in frames], ignore_index=True)
+	return pd.DataFrame(combined)
+
+def concat_chunks (chunks, columns):
+	if len(chunks) == 0:
+		return pd.DataFrame({column: pd.Series(dtype=('datetime64[ns]' if dtype == 'datetime' else dtype)) for column, dtype in columns.items()})
+	if len(chunks) == 1:
+		return chunks[0].reset_index(drop=True)
+	return concat_frames(chunks)
+
+def export_csv_path (export_dir, table):
+	return os.path.join(export_dir, table + '.csv')
+
+def read_export_chunks (csv_path, columns, chunksize=CSV_CHUNK_ROWS, offset=0):
+	# Yields the export CSV in chunks of the given {column: dtype} columns, in that order
+	# With an offset (the end of a row, e.g. the file's size when it was last read), only the rows from there on are read
+	dtypes = {column: dtype for column, dtype in columns.items() if dtype != 'datetime'}
+	parse_dates = [column for column, dtype in columns.items() if dtype == 'datetime']
+	options = {'usecols': list(columns), 'dtype': dtypes, 'parse_dates': parse_dates, 'chunksize': chunksize, 'low_memory': False} # low_memory would parse each chunk in smaller blocks and fail to combine their categoricals
+	if not offset:
+		with pd.read_csv(csv_path, **options) as reader:
+			for chunk in reader:
+				yield chunk[list(columns)]
+		return
+	with open(csv_path, newline='') as csv_file:
+		header = next(csv.reader(csv_file))
+	with open(csv_path, 'rb') as csv_file:
+		csv_file.seek(offset)
+		try:
+			reader = pd.read_csv(csv_file, header=None, names=header, **options)
+		except pd.errors.EmptyDataError: # nothing past the offset
+			return
+		with reader:
+			for chunk in reader:
+				yield chunk[list(columns)]
+
+def window_start (start_bound, lookback=None):
+	return None if not start_bound else pd.Timestamp(start_bound) - (lookback if lookback is not None else pd.Timedelta(0))
+
+def window_rows (chunk, start_bound=None, end_bound=None, lookback=None):
+	# Rows inside the (start_bound - lookback, end_bound) window; lookback rows are kept inclusively so rows exactly at the edge can still be compared against
+	keep_after = window_start(start_bound, lookback)
+	if keep_after is not None:
+		chunk = chunk[chunk['created_at'] >= keep_after] if lookback is not None else chunk[chunk['created_at'] > keep_after]
+	if end_bound:
+		chunk = chunk[chunk['created_at'] < end_bound]
+	return chunk
+
+def read_export_table (csv_path, table, start_bound=None, end_bound=None, lookback=None, on_chunk=None, ids=None, chunksize=CSV_CHUNK_ROWS, offset=0):
+	# Streams one export CSV and keeps only rows inside the (start_bound - lookback, end_bound) window
+	# on_chunk(chunk) sees every full chunk before it is windowed, for anything that has to be derived from the whole table (ids are still strings there)
+	# If ids (an encoding.ExportIds) is given, id columns of the kept rows are replaced with int32 codes
+	# With an offset, only rows from there on are read (see read_export_chunks()), and "the whole table" means just those rows
+	# Returns (windowed frame, TableSummary of the whole table)
+	columns = EXPORT_COLUMNS[table]
+	summary = TableSummary()
+	kept_chunks = []
+	for chunk in read_export_chunks(csv_path, columns, chunksize, offset):
+		summary.update(chunk)
+		if on_chunk: on_chunk(chunk)
+		chunk = window_rows(chunk, start_bound, end_bound, lookback)
+		if len(chunk) > 0:
+			if ids is not None: ids.encode_frame(chunk)
+			kept_chunks.append(chunk)
+	if ids is not None:
+		columns = {column: ('int32' if column in ID_COLUMNS else dtype) for column, dtype in columns.items()}
+	return concat_chunks(kept_chunks, columns), summary
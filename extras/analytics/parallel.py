@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .cache import has_parquet
+from .pipeline import max_rss_bytes
+from .windows import WindowIndex
+# The cleaned frames are handed to worker processes as memory-mapped Arrow IPC files, which needs pyarrow (see cache.has_parquet)
+if has_parquet:
+	import pyarrow as pa
+	import pyarrow.feather as feather
+
+# Report sections only read the cleaned frames, so every (window, section) pair can run in its own process
+# The frames are written once, uncompressed, to a temporary directory; each worker maps them when it starts (fixed-width columns come straight from the page cache), instead of every task pickling them
+# Results are collected in window then section order, so the report is the same as a serial run whatever order tasks finish in
+
+def share_frames (frames, shared_dir):
+	for name, frame in frames.items():
+		feather.write_feather(frame.reset_index(drop=True), os.path.join(shared_dir, name + '.arrow'), compression='uncompressed')
+
+def map_shared_frame (path):
+	with pa.memory_map(path) as source:
+		return pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+
+# Per worker process: the mapped frames, and a WindowIndex over them built on first use
+worker_frames = None
+worker_window_index = None
+
+def init_worker (shared_dir, frame_names):
+	global worker_frames, worker_window_index
+	worker_frames = {name: map_shared_frame(os.path.join(shared_dir, name + '.arrow')) for name in frame_names}
+	worker_window_index = None
+
+def run_section_task (section, window_factory, start_bound, end_bound):
+	# Returns (section results, seconds, worker's max RSS)
+	global worker_window_index
+	started = time.perf_counter()
+	if worker_window_index is None: worker_window_index = WindowIndex(worker_frames)
+	window = window_factory(worker_window_index.rows(start_bound, end_bound), start_bound=start_bound, end_bound=end_bound)
+	results = section.compute(window)
+	return results, round(time.perf_counter() - started, 6), max_rss_bytes()
+
+def compute_sections_parallel (sections, frames, windows, window_factory, instrumentation, workers, labels=None):
+	# Like pipeline.compute_sections(), for every (start_bound, end_bound) in windows at once; returns one {section name: results} per window
+	# window_factory(frames, start_bound=..., end_bound=...) builds what section.compute() takes; it and the sections must be picklable (module-level)
+	series = []
+	shared_dir = tempfile.mkdtemp(prefix='analytics-shared-')
+	try:
+		with instrumentation.stage('Share cleaned frames', rows_in=sum(map(len, frames.values()))):
+			share_frames(frames, shared_dir)
+		with instrumentation.stage(f'Sections ({workers} processes)'):
+			with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(shared_dir, list(frames))) as pool:
+				futures = [[pool.submit(run_section_task, section, window_factory, start_bound, end_bound) for section in sections] for start_bound, end_bound in windows]
+				for window_number, window_futures in enumerate(futures):
+					label = labels[window_number] if labels else None
+					results = {}
+					for section, future in zip(sections, window_futures):
+						results[section.name], seconds, worker_max_rss = future.result()
+						instrumentation.add_worker_stage(f'Section: {section.name}' + (f' ({label})' if label else ''), seconds, worker_max_rss)
+					series.append(results)
+	finally:
+		shutil.rmtree(shared_dir, ignore_errors=True)
+	return series
@@ -0,0 +1,93 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+try:
+	import resource
+except ImportError: # not available on Windows
+	resource = None
+
+class Instrumentation:
+	# Records wall time, memory and rows in/out for every stage the report goes through
+	# Peak memory per stage needs tracemalloc, which slows allocation-heavy code down, so it's opt-in; the process' max RSS so far is always recorded
+	def __init__ (self, trace_memory=False):
+		self.trace_memory = trace_memory
+		self.stages = []
+		if trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	@contextmanager
+	def stage (self, name, rows_in=None):
+		# Yields the stage's record; set record['rows_out'] (and rows_in, if it wasn't known up front) inside the block
+		record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+		if self.trace_memory: tracemalloc.reset_peak()
+		started = time.perf_counter()
+		try:
+			yield record
+		finally:
+			record['seconds'] = round(time.perf_counter() - started, 6)
+			record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+			record['max_rss_bytes'] = max_rss_bytes()
+			self.stages.append(record)
+
+	def add_worker_stage (self, name, seconds, max_rss):
+		# A stage that ran in a worker process, inside whichever stage of this process waited for it; not counted in the total
+		self.stages.append({'stage': name, 'rows_in': None, 'rows_out': None, 'seconds': seconds, 'peak_traced_bytes': None, 'max_rss_bytes': max_rss, 'worker': True})
+
+	def lines (self):
+		lines = [f'{'Stage':<40} {'Seconds':>9} {'Rows in':>10} {'Rows out':>10} {'Peak MiB':>9} {'Max RSS MiB':>12}']
+		for record in self.stages:
+			name = ('  ' + record['stage']) if record.get('worker') else record['stage']
+			lines.append(f'{name:<40} {record['seconds']:>9.3f} {format_rows(record['rows_in']):>10} {format_rows(record['rows_out']):>10} {format_mib(record['peak_traced_bytes']):>9} {format_mib(record['max_rss_bytes']):>12}')
+		lines.append(f'{'Total':<40} {sum(record['seconds'] for record in self.stages if not record.get('worker')):>9.3f}')
+		return lines
+
+	def write_json (self, path):
+		with open(path, 'w') as stats_file:
+			json.dump({'trace_memory': self.trace_memory, 'stages': self.stages}, stats_file, indent='\t')
+
+def format_rows (rows):
+	return '-' if rows is None else str(rows)
+
+def format_mib (size):
+	return '-' if size is None else f'{size / 2 ** 20:.1f}'
+
+def max_rss_bytes ():
+	if resource is None: return None
+	max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return max_rss if sys.platform == 'darwin' else max_rss * 1024 # Linux reports KiB, macOS bytes
+
+class FilterStage:
+	# One cleaning rule: which frames it applies to and which of their rows to keep
+	# keep(frame, context) returns a boolean array over frame's rows; prepare(context), if given, runs once first (e.g. to find spam) and may add to the context
+	def __init__ (self, name, frame_names, keep, prepare=None):
+		self.name = name
+		self.frame_names = frame_names
+		self.keep = keep
+		self.prepare = prepare
+
+def run_filters (stages, frames, context, instrumentation):
+	# Applies the stages in order to the named frames (updated in place), timing each one
+	for stage in stages:
+		with instrumentation.stage(stage.name, rows_in=sum(len(frames[name]) for name in stage.frame_names)) as record:
+			if stage.prepare: stage.prepare(context)
+			for name in stage.frame_names:
+				frames[name] = frames[name][stage.keep(frames[name], context)]
+			record['rows_out'] = sum(len(frames[name]) for name in stage.frame_names)
+	return frames
+
+class ReportSection:
+	# One section of the report: compute(window) returns its results as plain data, render(results, write) turns them into text lines
+	def __init__ (self, name, compute, render):
+		self.name = name
+		self.compute = compute
+		self.render = render
+
+def compute_sections (sections, window, instrumentation, label=None):
+	# Returns {section name: results}, in section order, timing each one (label tells stages of different windows apart)
+	results = {}
+	for section in sections:
+		with instrumentation.stage(f'Section: {section.name}' + (f' ({label})' if label else '')):
+			results[section.name] = section.compute(window)
+	return results
@@ -0,0 +1,472 @@
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime, UTC
+from .ingest import UMAMI_TIMESTAMP_FORMAT
+from .cleaning import ANALYTICS_ADDED_TS
+from .countries import resolve_country_names
+from .pipeline import ReportSection
+
+# The report's sections: each computes its results from a ReportWindow (the cleaned frames cut to one pair of bounds) and renders them as text; see report_sections
+
+# Define util functions & values
+def times (quantity, words='time', pluralizer=None):
+	if isinstance(words, str):
+		single = words
+		if pluralizer == None: pluralizer = 's'
+		plural = words + pluralizer
+	else:
+		single = words[0]
+		if pluralizer == None: pluralizer = ''
+		plural = words[1] + pluralizer
+	return str(quantity) + ' ' + (single if quantity == 1 else plural)
+
+def format_window (start_bound, end_bound):
+	return f'{f'{start_bound:{UMAMI_TIMESTAMP_FORMAT}}' if start_bound else '...'} - {f'{end_bound:{UMAMI_TIMESTAMP_FORMAT}}' if end_bound else '...'}'
+
+class ReportWindow:
+	# The cleaned frames cut to one pair of bounds, plus what several sections share
+	def __init__ (self, frames, summaries, start_bound, end_bound, country_names_memo_path):
+		self.user_sessions = frames['user_sessions']
+		self.user_we_events = frames['user_we_events']
+		self.valid_ed_events = frames['valid_ed_events']
+		self.summaries = summaries
+		self.start_bound = start_bound
+		self.end_bound = end_bound
+		self.country_names_memo_path = country_names_memo_path
+		self.total_user_sessions = len(self.user_we_events['session_id'].unique())
+		self.visits_df = self.user_we_events[['session_id', 'visit_id']].drop_duplicates()
+
+'''
+Notes:
+	- Session = (hopefully unique) person/visitor/user
+	- Visit = a length of time where a user interacts with the website. Comes under session, aka a user can have many visits
+	- View = when a page is viewed. Comes under visit, so in one visit, a page can be viewed multiple times
+'''
+
+
+
+# Show initial data
+def compute_overview (window):
+	sd_summary, we_summary, ed_summary = window.summaries['session_data'], window.summaries['website_event'], window.summaries['event_data']
+	total_records = ed_summary.rows + sd_summary.rows + we_summary.rows
+	return {
+		'generated_at': datetime.now(UTC).strftime(UMAMI_TIMESTAMP_FORMAT),
+		'earliest_record': min(ed_summary.earliest, sd_summary.earliest, we_summary.earliest),
+		'latest_record': min(ed_summary.latest, sd_summary.latest, we_summary.latest),
+		'start_bound': window.start_bound,
+		'end_bound': window.end_bound,
+		'total_records': total_records,
+		'total_valid_records': len(window.valid_ed_events) + len(window.user_sessions) + len(window.user_we_events),
+		'earliest_used_record': min(window.valid_ed_events['created_at'].min(), window.user_sessions['created_at'].min(), window.user_we_events['created_at'].min()),
+		'latest_used_record': max(window.valid_ed_events['created_at'].max(), window.user_sessions['created_at'].max(), window.user_we_events['created_at'].max()),
+	}
+
+def render_overview (overview, write):
+	start_bound, end_bound = overview['start_bound'], overview['end_bound']
+	write('###')
+	write(f'Report generated at {overview['generated_at']}. This report is based on data collected by and exported from Umami analytics. The earliest record in this export is from {overview['earliest_record']} while the latest record is from {overview['latest_record']}. Detailed Umami analytics (i.e. including events and not just page views) was added for the public on {ANALYTICS_ADDED_TS}, so records from before then are dropped, even though they may have been valid user visits.')
+	write('You can find the current public Umami analytics dashboard at <https://cloud.umami.is/share/b0K7JX1ecA9aZJPP>.')
+	write('---')
+	if not start_bound and not end_bound:
+		write('The data was not filtered by time.')
+	else:
+		write(f'The data was filtered by time. Start bound: {f'{start_bound:%B %d, %Y, %H:%M:%S}' if start_bound else '<no start bound>'}. End bound: {f'{end_bound:%B %d, %Y, %H:%M:%S}' if end_bound else '<no end bound>'}.')
+	write(f'Processed {overview['total_records']} records, removed {overview['total_records'] - overview['total_valid_records']} development/old/invalid events from that.')
+	write(f'The following statistics are based on the remaining {overview['total_valid_records']} real user events.')
+	write(f'From the first record at {overview['earliest_used_record']} to the last record at {overview['latest_used_record']} in UTC.')
+	write('###')
+	write()
+
+def compute_users (window):
+	# Get country names from Umami source data (ISO 3166-1 alpha-2 country codes)
+	# Countries in order of first appearance; a missing country is listed too, with a count of 0 (the old per-country loop compared it with ==, which never matches)
+	country_counts = window.user_we_events[['session_id', 'country']].drop_duplicates()['country'].value_counts(sort=False, dropna=False)
+	country_counts = country_counts.mask(country_counts.index.isna(), 0)
+	country_names = resolve_country_names(country_counts.index.tolist(), window.country_names_memo_path)
+	return {
+		'total_user_sessions': window.total_user_sessions,
+		'countries': [[country_name, int(country_count)] for country_name, country_count in zip(country_names, country_counts)],
+		'total_user_visits': len(window.visits_df),
+		'total_user_views': len(window.user_we_events[window.user_we_events['event_type'] == 1]),
+	}
+
+def render_users (users, write):
+	countries = [f'{country_name} ({country_count})' for country_name, country_count in users['countries']]
+	write('== Users, visits, and views ==')
+	write('Number of unique real people:', users['total_user_sessions'])
+	write(f'They come from {times(len(countries), words=['different country', 'different countries'])}: {', '.join(countries)}')
+	write('Number of real user page visits:', users['total_user_visits'])
+	write('Number of real user page views:', users['total_user_views'])
+	write()
+
+
+
+# Count number of repeat visitors
+def count_repeat_visitors (visits_df, events_df):
+	# [number of users, number of their events] for users who visited exactly 1, 2, 3... times, up to the most visits anyone had
+	# Visits and events are counted per session once, then bucketed by visit count
+	# A missing session id (-1) is no user, same as value_counts() skipping missing strings
+	visits_per_session = visits_df['session_id'][visits_df['session_id'] >= 0].value_counts()
+	events_per_session = events_df.drop_duplicates('event_id')['session_id'].value_counts().reindex(visits_per_session.index, fill_value=0)
+	return bucket_repeat_visitors(visits_per_session.to_numpy(), events_per_session.to_numpy())
+
+def bucket_repeat_visitors (visits_per_session, events_per_session):
+	# Same, from per-session visit and event counts (aligned arrays)
+	max_visits = int(visits_per_session.max()) if len(visits_per_session) else 0
+	user_counts = np.bincount(visits_per_session, minlength=max_visits + 1)[1:]
+	event_counts = np.bincount(visits_per_session, weights=events_per_session, minlength=max_visits + 1)[1:]
+	return [[int(user_count), int(event_count)] for user_count, event_count in zip(user_counts, event_counts)]
+
+def compute_repeat_visitors (window):
+	return count_repeat_visitors(window.visits_df, window.user_we_events)
+
+def render_repeat_visitors (repeats, write):
+	repeat_count = 1
+	write('== Repeat visitors ==')
+	for user_count, event_count in repeats:
+		write(f'{times(user_count, words=['person', 'people'])} visited exactly {times(repeat_count)}. Total: {times(event_count, words='event')}. Avg. per user: {times(round(event_count / user_count, 1), words='event') if (user_count > 0) else 'n/a'}.')
+		repeat_count += 1
+	write('Note that events here includes page views and so will be higher than the events in the events overview/in detail below.')
+	write()
+
+
+
+# Check what kinds of devices are used
+def compute_devices (window):
+	# A missing session id (-1) is no group, same as groupby() skipping missing strings
+	session_ids = window.user_we_events['session_id']
+	devices_by_session_id = window.user_we_events['device'].groupby(session_ids.where(session_ids >= 0)).unique()
+	return {
+		'total_user_sessions': window.total_user_sessions,
+		'devices': [[device, int(count)] for device, count in devices_by_session_id.explode().value_counts().items()],
+	}
+
+def render_devices (devices, write):
+	write('== Devices used ==')
+	for device, count in devices['devices']:
+		write(f'{times(count, words=['user is', 'users are'])} using a {device}.')
+	write(f'Note that one user can use multiple devices, so total may not add to {devices['total_user_sessions']} (total # of users).')
+	write()
+
+
+
+# Check where they came from
+referrer_map = {
+	'siege.hackclub.com': 'Siege (via Hack Club)',
+	'com.slack': 'Slack App',
+	'l.instagram.com': 'Instagram',
+	'm.facebook.com': 'Facebook',
+	'google.com': 'Google',
+	'github.com': 'GitHub',
+	'facebook.com': 'Facebook',
+	'instagram.com': 'Instagram',
+	'com.google.android.googlequicksearchbox': 'Android Google Search (System Package)',
+	'classroom.google.com': 'Google Classroom',
+}
+
+def compute_referrals (window):
+	visit_ids = window.user_we_events['visit_id']
+	number_of_users_by_referrer = window.user_we_events['referrer_domain'].groupby(visit_ids.where(visit_ids >= 0)).unique().explode().value_counts(dropna=False).items()
+	return {
+		'total_user_sessions': window.total_user_sessions,
+		'referrers': combine_referrers(number_of_users_by_referrer), # '' = not referred
+	}
+
+def combine_referrers (number_of_users_by_referrer):
+	# (referrer domain or NaN, count) pairs, most common first -> {referrer name: count}, with domains of the same site added up
+	number_by_referrer_combined = {}
+	for referrer, count in number_of_users_by_referrer:
+		if pd.isna(referrer):
+			number_by_referrer_combined[''] = int(count)
+		else:
+			referrer_name = referrer_map.get(referrer, referrer)
+			number_by_referrer_combined[referrer_name] = number_by_referrer_combined.get(referrer_name, 0) + int(count)
+	return number_by_referrer_combined
+
+def render_referrals (referrals, write):
+	write('== Visitor referrals ==')
+	for referrer_name, count in referrals['referrers'].items():
+		if referrer_name == '':
+			write(f'{times(count, words='user')} visited TC22 directly (not referred).')
+		else:
+			write(f'{times(count, words='user')} reached TC22 via {referrer_name}.')
+	write('Note that one user can use visit multiple times, so total may not add to', referrals['total_user_sessions'], '(total # of users).')
+	write()
+
+
+
+# Events overview
+event_count_ranges = ((0, 1), (2, 5), (6, 10), (11, 20), (21, 30), (31, 40), (41, 50), (51, 999))
+
+def compute_events_overview (window):
+	events = window.valid_ed_events.drop_duplicates('event_id')
+	event_names_by_session_id = events[events['session_id'] >= 0].groupby('session_id')['event_name'].count()
+	return summarize_events_per_user(event_names_by_session_id, window.total_user_sessions)
+
+def summarize_events_per_user (event_names_by_session_id, total_user_sessions):
+	# event_names_by_session_id: number of events of every user with at least one event row (int64 Series or array, any order)
+	# Users without any are only counted (they all have 0 events, so they sort first), never materialized; every statistic below matches what pandas/scipy give over the counts padded with zeros
+	event_counts = np.sort(np.asarray(event_names_by_session_id, dtype='int64'))
+	zero_users = max(total_user_sessions - len(event_counts), 0)
+	user_count = zero_users + len(event_counts)
+	def users_with_fewer (values, side):
+		# Users with fewer than (side='left') or at most (side='right') each of values events, for values >= 0
+		return np.searchsorted(event_counts, values, side=side) + zero_users * (np.asarray(values) > 0 if side == 'left' else 1)
+	def count_at (position):
+		return 0 if position < zero_users else int(event_counts[position - zero_users])
+	# Event count ranges are inclusive on both ends
+	range_starts, range_ends = np.array(event_count_ranges).T
+	users_in_ranges = users_with_fewer(range_ends, 'right') - users_with_fewer(range_starts, 'left')
+	if user_count == 0:
+		mean_events = percentile_of_mean = max_events = np.nan
+		quantile_values = [np.nan] * 3
+	else:
+		mean_events = np.float64(event_counts.sum()) / user_count
+		# scipy.stats.percentileofscore(kind='rank'): the average of the strict and weak percentile ranks, plus one score for a tie
+		below, at_or_below = int(users_with_fewer(mean_events, 'left')), int(users_with_fewer(mean_events, 'right'))
+		percentile_of_mean = np.float64((below + at_or_below + (below < at_or_below)) * (50.0 / user_count))
+		# Series.quantile()'s linear interpolation between the two closest ranks
+		quantile_values = []
+		for quantile in (0.25, 0.5, 0.75):
+			position = quantile * (user_count - 1)
+			lower = int(position)
+			upper = min(lower + 1, user_count - 1)
+			quantile_values.append(float(count_at(lower) + (count_at(upper) - count_at(lower)) * (position - lower)))
+		max_events = count_at(user_count - 1)
+	return {
+		'total_user_sessions': total_user_sessions,
+		'avg_events_per_user': round(mean_events, 2),
+		'percentile_of_avg_events': round(percentile_of_mean, 2),
+		'quantile_values': quantile_values,
+		'max_events': max_events,
+		'users_in_ranges': [[int(range_start), int(range_end), int(users)] for range_start, range_end, users in zip(range_starts, range_ends, users_in_ranges)], # [lowest event count, highest event count, number of users]
+	}
+
+def render_events_overview (overview, write):
+	quantile_values = overview['quantile_values']
+	write('== Events overview ==')
+	write(f'There are {overview['total_user_sessions']} users, and on average, each user does about {overview['avg_events_per_user']} events. This is more than {overview['percentile_of_avg_events']}% of users. 75% of users have at least {quantile_values[0]} events, 50% of users have at least {quantile_values[1]} events, and 25% of users have at least {quantile_values[2]} events. The user with the most events has {overview['max_events']} events.')
+	for range_start, range_end, users_in_range_count in overview['users_in_ranges']:
+		single = (range_start == range_end)
+		write(f'{times(users_in_range_count, words='user')} have {range_start if single else (f'between {range_start} and {range_end}')} {'event' if (single and (range_start == 1)) else 'events'}.')
+	write()
+
+# Events in detail
+class EventDetailIndex:
+	# Everything the "Events in detail" section looks up, grouped once over (event_name, data_key, string_value), so each lookup is a dict access instead of a scan
+	#  - event_counts_by_name: [(event name, unique events)], most common first
+	#  - unique_events_by_nkv: {(name, key, value): unique events}
+	#  - values_by_nk: {(name, key): [[value, rows]], most common first}
+	#  - max_value_by_nk: {(name, key): string max of the values}
+	def __init__ (self, event_counts_by_name, unique_events_by_nkv, values_by_nk, max_value_by_nk):
+		self.event_counts_by_name = event_counts_by_name
+		self.unique_events_by_nkv = unique_events_by_nkv
+		self.values_by_nk = values_by_nk
+		self.max_value_by_nk = max_value_by_nk
+
+	@classmethod
+	def from_events (cls, events_df):
+		# groupby(sort=False) keeps first-appearance order, and sorting by count with a stable sort breaks ties the same way value_counts() does
+		# A missing event id (-1) is no event, same as nunique() skipping missing strings
+		event_ids = events_df['event_id'].where(events_df['event_id'] >= 0)
+		by_name = event_ids.groupby(events_df['event_name'], sort=False).nunique()
+		event_counts_by_name = list(by_name.sort_values(ascending=False, kind='stable').items())
+		by_nkv = event_ids.groupby([events_df['event_name'], events_df['data_key'], events_df['string_value']], sort=False, observed=True)
+		values_by_nk = {}
+		for (name, key, value), count in by_nkv.size().items():
+			values_by_nk.setdefault((name, key), []).append([value, count])
+		for value_counts in values_by_nk.values():
+			value_counts.sort(key=lambda value_count: -value_count[1])
+		# string max, like Series.max() over the string_value column
+		max_value_by_nk = events_df.groupby(['event_name', 'data_key'], sort=False, observed=True)['string_value'].max().to_dict()
+		return cls(event_counts_by_name, by_nkv.nunique().to_dict(), values_by_nk, max_value_by_nk)
+
+	def event_counts (self):
+		return self.event_counts_by_name
+
+	def unique_events (self, name, key, values):
+		if isinstance(values, str):
+			values = {values}
+		return sum(self.unique_events_by_nkv.get((name, key, value), 0) for value in values)
+
+	def top_values (self, name, key, n):
+		return [[value, count] for value, count in self.values_by_nk.get((name, key), [])[:n]]
+
+	def max_value (self, name, key):
+		return self.max_value_by_nk.get((name, key), float('nan'))
+
+event_name_map = {
+	'sidebar-page-navigated': 'Users went to a sidebar page',
+	'sidebar-toggled': 'Users toggled the sidebar',
+	'simulated-fullscreen-entered': 'Users entered the simulated fullscreen mode',
+	'simulated-fullscreen-exited': 'Users exited the simulated fullscreen mode',
+	'school-selected': 'Users picked their school',
+	'school-name-clicked': 'Users clicked the school name in the bottom middle',
+	'notes-toggled': 'Users toggled the notes widget',
+	'setting-changed': 'Users changed their settings',
+	'toggle-fullscreen-clicked': 'Users toggled fullscreen',
+	'timer-toggled': 'Users toggled the timer widget',
+	'get-pwa-clicked': 'Users clicked the "Get app" button',
+	'stopwatch-toggled': 'Users toggled the stopwatch widget',
+	'notes-updated': 'Users edited their notes',
+	'timer-used': 'Users interacted with the timer widget',
+	'stopwatch-used': 'Users interacted with the stopwatch widget',
+	'division-selected': 'Users picked their division',
+}
+schools_map = {
+	-2: 'Always High School',
+	-1: 'None',
+	1: 'Chino Hills High School',
+	2: 'Cal Aero Preserve Academy JH',
+	3: 'Ayala High School',
+	4: 'Ruth Fox Middle School',
+}
+
+def count_unique_events_by_nkv (event_index, name, key, values):
+	return event_index.unique_events(name, key, values)
+
+def top_n_values (event_index, name, key, n):
+	result = event_index.top_values(name, key, n)
+	return [len(result), result]
+
+def format_top_string_values (result):
+	if len(result) == 0: return '(none)'
+	if len(result) > 1: result[-1][0] = 'and ' + result[-1][0]
+	return (', ' if len(result) > 2 else ' ').join(map(lambda combined: f'{combined[0]} ({combined[1]})', result))
+
+def get_auxiliary_event_info (event_index, event_name):
+	info = ''
+
+	if 0: pass # it looks nicer when the other ones are all 'elif' :]
+	# By the way, I've commented events because the information isn't that useful to know. I'd rather a cleaner output with useful information that a messy one with all the information.
+	elif event_name == 'setting-changed':
+		total, setting_counts = top_n_values(event_index, event_name, 'setting', 5)
+		info = f'The top {times(total, words='setting')} changed were {format_top_string_values(setting_counts)}.'
+	elif event_name == 'school-selected':
+		total, school_counts = top_n_values(event_index, event_name, 'schoolId', 3)
+		school_counts = [[schools_map.get(int(schoolId), 'School ID ' + schoolId), count] for schoolId, count in school_counts]
+		info = f'The top {times(total, words='school')} selected were {format_top_string_values(school_counts)}.'
+	elif event_name == 'sidebar-page-navigated':
+		total, page_counts = top_n_values(event_index, event_name, 'page', 5)
+		info = f'The top {times(total, words='page')} navigated to were {format_top_string_values(page_counts)}.'
+	elif event_name == 'school-name-clicked':
+		no_school_count = count_unique_events_by_nkv(event_index, event_name, 'alreadySelected', 'false')
+		already_school_count = count_unique_events_by_nkv(event_index, event_name, 'alreadySelected', 'true')
+		info = f'This was {times(no_school_count, words=["user's", "users'"])} first school selected and {times(already_school_count, words='user')} already had a school selected.'
+	elif event_name == 'simulated-fullscreen-entered':
+		total, element_counts = top_n_values(event_index, event_name, 'id', 3)
+		info = f'The top {times(total, words='element')} entered were {format_top_string_values(element_counts)}.'
+	# elif event_name == 'simulated-fullscreen-exited':
+	# 	total, element_counts = top_n_values(event_index, event_name, 'id', 3)
+	# 	info = f'The top {times(total, words='element')} exited were {format_top_string_values(element_counts)}.'
+	elif event_name == 'division-selected':
+		division_total, division_counts = top_n_values(event_index, event_name, 'divisionLabel', 3)
+		info = f'The top {times(division_total, words=['division was', 'divisions were'])} {format_top_string_values(division_counts)}.'
+	elif event_name == 'get-pwa-clicked':
+		no_school_count = count_unique_events_by_nkv(event_index, event_name, 'outcome', 'dismissed')
+		already_school_count = count_unique_events_by_nkv(event_index, event_name, 'outcome', 'accepted')
+		info = f'The app download was accepted {times(already_school_count)} and dismissed {times(no_school_count)}.'
+	elif event_name == 'notes-updated':
+		longest_note_length = float(event_index.max_value(event_name, 'length'))
+		info = f'The longest note was {times(longest_note_length, words='character')}.'
+	# elif event_name in {'stopwatch-toggled', 'timer-toggled', 'notes-toggled'}:
+	# 	opened_count = count_unique_events_by_nkv(event_index, event_name, 'newState', 'open')
+	# 	closed_count = count_unique_events_by_nkv(event_index, event_name, 'newState', 'closed')
+	# 	info = f'It was opened {times(opened_count)} and closed {times(closed_count)}.'
+	# elif event_name == 'sidebar-toggled':
+	# 	opened_count = count_unique_events_by_nkv(event_index, event_name, 'isOpenNow', 'true')
+	# 	closed_count = count_unique_events_by_nkv(event_index, event_name, 'isOpenNow', 'false')
+	# 	info = f'It was toggled open {times(closed_count)} and closed {times(opened_count)}.'
+	elif event_name == 'toggle-fullscreen-clicked':
+		entered_count = count_unique_events_by_nkv(event_index, event_name, 'attemptedNewState', 'fullscreen')
+		exited_count = count_unique_events_by_nkv(event_index, event_name, 'attemptedNewState', 'no-fullscreen')
+		info = f'They entered fullscreen {times(entered_count)} and exited fullscreen {times(exited_count)}.'
+	elif event_name == 'stopwatch-used':
+		started_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'start')
+		stopped_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'stop')
+		resetted_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'reset')
+		info = f'They started it {times(started_count)}, stopped it {times(stopped_count)}, and reset it {times(resetted_count)}.'
+	elif event_name == 'timer-used':
+		started_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'start')
+		stopped_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'stop')
+		muted_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'mute')
+		unmuted_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'unmute')
+		resetted_count = count_unique_events_by_nkv(event_index, event_name, 'event', 'reset')
+		info = f'They started it {times(started_count)}, stopped it {times(stopped_count)}, muted it {times(muted_count)}, unmuted it {times(unmuted_count)}, and reset it {times(resetted_count)}.'
+
+	return info
+
+def compute_events_in_detail (window):
+	# [event name, number of events, auxiliary info], most common first
+	return describe_events(EventDetailIndex.from_events(window.valid_ed_events))
+
+def describe_events (event_index):
+	return [[event_name, int(count), get_auxiliary_event_info(event_index, event_name)] for event_name, count in event_index.event_counts()]
+
+def render_events_in_detail (events, write):
+	write('== Events in detail ==')
+	for event_name, count, auxiliary_info in events:
+		event_description = event_name_map.get(event_name)
+		auxiliary_info = (' ' + auxiliary_info) if auxiliary_info else ''
+		if event_description:
+			write(f'{event_description} {times(count)}.{auxiliary_info}')
+		else:
+			write(f'The {event_name} event happened {times(count)}.{auxiliary_info}')
+	write()
+
+report_sections = [
+	ReportSection('overview', compute_overview, render_overview),
+	ReportSection('users', compute_users, render_users),
+	ReportSection('repeat_visitors', compute_repeat_visitors, render_repeat_visitors),
+	ReportSection('devices', compute_devices, render_devices),
+	ReportSection('referrals', compute_referrals, render_referrals),
+	ReportSection('events_overview', compute_events_overview, render_events_overview),
+	ReportSection('events_in_detail', compute_events_in_detail, render_events_in_detail),
+]
+
+
+
+# Render a computed report
+def render_text (results, sections=None):
+	lines = []
+	def write (*args):
+		lines.append(' '.join(map(str, args)) + '\n')
+	for section in (report_sections if sections is None else sections):
+		section.render(results[section.name], write)
+	write('End of report')
+	write('###')
+	return ''.join(lines)
+
+def json_values (value):
+	# NaN/NaT (when a window is empty) as None, since JSON has no NaN
+	if isinstance(value, dict):
+		return {key: json_values(item) for key, item in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [json_values(item) for item in value]
+	if value is pd.NaT or (isinstance(value, float) and value != value):
+		return None
+	return value
+
+def to_json (value):
+	# Timestamps/datetimes are written as strings
+	return json.dumps(json_values(value), indent='\t', default=str, allow_nan=False) + '\n'
+
+def render_json (results):
+	return to_json(results)
+
+def render_text_series (series, sections=None):
+	# One full report per window, separated by a blank line
+	return '\n'.join(render_text(results, sections) for _, _, results in series)
+
+def render_json_series (series):
+	return to_json([{'start_bound': start_bound, 'end_bound': end_bound, 'sections': results} for start_bound, end_bound, results in series])
+
+report_renderers = {
+	'text': render_text,
+	'json': render_json,
+}
+series_renderers = {
+	'text': render_text_series,
+	'json': render_json_series,
+}
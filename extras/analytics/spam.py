@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+class SessionOrder:
+	# One stable sort of a table by (session_id, other group columns, created_at), plus flags for where each group starts/ends in that order
+	# Rows of a group end up next to each other in time order (ties keep file order), so "compare with the previous row of my group" is a plain array shift
+	# Rows with a missing group value never belong to a group, same as groupby() dropping them
+	# A missing created_at sorts first in its group; such a row starts a group and has no successor in it, since its diff with anything is missing too
+	def __init__ (self, frame, group_columns):
+		group_codes = [(frame[column].to_numpy() if column == 'session_id' else pd.factorize(frame[column])[0]) for column in group_columns]
+		timestamps = frame['created_at'].to_numpy(dtype='datetime64[ns]').view('int64')
+		self.order = np.lexsort([timestamps, *reversed(group_codes)]) # lexsort's last key is the primary one
+		self.timestamps = timestamps[self.order]
+		row_count = len(self.order)
+		self.group_start = np.zeros(row_count, dtype=bool)
+		self.group_start[:1] = True
+		missing = np.zeros(row_count, dtype=bool)
+		for codes in group_codes:
+			sorted_codes = codes[self.order]
+			self.group_start[1:] |= (sorted_codes[1:] != sorted_codes[:-1])
+			missing |= (sorted_codes < 0)
+		missing_time = np.isnat(self.timestamps.view('datetime64[ns]'))
+		self.group_start |= missing | missing_time
+		self.group_start[1:] |= missing_time[:-1]
+		self.group_end = np.ones(row_count, dtype=bool)
+		self.group_end[:-1] = self.group_start[1:]
+		self.group_end &= ~(missing | missing_time)
+
+	def within (self, threshold):
+		# Boolean per row (in the table's own order): did this row come no later than threshold after the previous row of its group?
+		deltas = np.diff(self.timestamps, prepend=self.timestamps[:1])
+		close = ~self.group_start & (deltas <= pd.Timedelta(threshold).value)
+		result = np.empty(len(close), dtype=bool)
+		result[self.order] = close
+		return result
+
+	def last_rows (self):
+		# Row positions of the last row of every group
+		return self.order[self.group_end]
+
+def find_spam (frame, group_columns, threshold, tail=None):
+	# Flags rows that came within threshold of the previous row in their group
+	# tail holds the latest created_at of every group from rows processed in an earlier run, so the first new row of a group is still compared with its real predecessor
+	# Returns (boolean array aligned with frame's rows, the latest row of every group frame has rows in), the latter being what merge_tails() adds to tail for the next run
+	key_columns = group_columns + ['created_at']
+	keys = frame[key_columns]
+	if tail is not None and len(tail) > 0:
+		keys = pd.concat([tail[key_columns], keys], ignore_index=True)
+	session_order = SessionOrder(keys, group_columns)
+	first_new_row = len(keys) - len(frame)
+	spam = session_order.within(threshold)[first_new_row:]
+	last_rows = session_order.last_rows()
+	tail_updates = keys.iloc[last_rows[last_rows >= first_new_row]].reset_index(drop=True)
+	return spam, tail_updates
+
+def merge_tails (tails, group_columns):
+	# Tails (or tail updates from find_spam()) in the order they were found, merged into one with the latest row of every group
+	tail = pd.concat([tail for tail in tails if len(tail) > 0] or tails[:1], ignore_index=True)
+	return tail.drop_duplicates(subset=group_columns, keep='last').reset_index(drop=True)
@@ -0,0 +1,52 @@
+import re
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import pytest
+from analytics.analyze import main
+from analytics.database import UmamiDatabase, load_export
+from analytics.generate_export import generate_export
+
+# Umami's Postgres stores created_at as timestamptz, so psycopg gives timezone-aware datetimes, in the connection's time zone
+# These tests make the SQLite stand-in give them too (in a zone other than UTC, so a missed conversion shows), by wrapping what it fetches
+TIMESTAMP_PATTERN = re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d$')
+SESSION_TIME_ZONE = timezone(timedelta(hours=5, minutes=30))
+BOUNDS = ['--start', '2025-12-20', '--end', '2026-01-10 12:00:00']
+
+def as_aware (value):
+	if isinstance(value, str) and TIMESTAMP_PATTERN.match(value):
+		return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).astimezone(SESSION_TIME_ZONE)
+	return value
+
+@pytest.fixture(scope='module')
+def export_dir (tmp_path_factory):
+	export_dir = tmp_path_factory.mktemp('export')
+	generate_export(str(export_dir), 20000)
+	return export_dir
+
+@pytest.fixture
+def aware_database (export_dir, tmp_path, monkeypatch):
+	url = f'sqlite:///{tmp_path / 'umami.db'}'
+	load_export(str(export_dir), url)
+	fetch_batches, fetch_row = UmamiDatabase.fetch_batches, UmamiDatabase.fetch_row
+	monkeypatch.setattr(UmamiDatabase, 'fetch_batches', lambda self, *args: ([list(map(as_aware, row)) for row in batch] for batch in fetch_batches(self, *args)))
+	monkeypatch.setattr(UmamiDatabase, 'fetch_row', lambda self, *args: list(map(as_aware, fetch_row(self, *args))))
+	return url
+
+def write_report (source, tmp_path, name, bounds):
+	output_path = tmp_path / f'{name}.txt'
+	main([str(source), *bounds, '--quiet', '--cache-dir', str(tmp_path / f'{name}-cache'), '--stats', str(tmp_path / f'{name}-stats.json'), '--output', str(output_path)])
+	return [line for line in output_path.read_text().splitlines() if 'generated at' not in line]
+
+def test_fetch_frame_gives_naive_utc_times (export_dir, aware_database):
+	database = UmamiDatabase(aware_database)
+	frame, _ = database.fetch_frame('website_event', ['event_id', 'created_at'], [])
+	exported = pd.read_csv(export_dir / 'website_event.csv', usecols=['event_id', 'created_at'], parse_dates=['created_at'])
+	assert frame['created_at'].dt.tz is None
+	assert frame['event_id'].tolist() == exported['event_id'].tolist()
+	assert (frame['created_at'] == exported['created_at']).all()
+	summary = database.summary('website_event')
+	assert (summary.earliest, summary.latest) == (exported['created_at'].min(), exported['created_at'].max())
+
+@pytest.mark.parametrize('bounds', [[], BOUNDS], ids=['unbounded', 'bounded'])
+def test_report_matches_export (export_dir, aware_database, tmp_path, bounds):
+	assert write_report(aware_database, tmp_path, 'database', bounds) == write_report(export_dir, tmp_path, 'export', bounds)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+from analytics.report import count_repeat_visitors
+
+def reference_repeat_visitors (visits_df, events_df):
+	# The loop count_repeat_visitors() replaced: take the sessions left with exactly one visit, then drop one visit of every session and repeat
+	repeat_subset = visits_df.copy()
+	repeats = []
+	while len(repeat_subset) != 0:
+		repeat_users_subset = repeat_subset[~repeat_subset.duplicated('session_id', keep=False)]
+		repeat_users_events = events_df[events_df['session_id'].isin(repeat_users_subset['session_id'])]['event_id'].unique()
+		repeats.append([len(repeat_users_subset), len(repeat_users_events)])
+		repeat_subset = repeat_subset[repeat_subset.duplicated('session_id')]
+	return repeats
+
+def random_frames (seed):
+	# Visit counts are drawn from a few spread-out values, so some buckets in between have no users
+	# About a third of the sessions have no events, and some events have more than one row
+	rng = np.random.default_rng(seed)
+	session_count = int(rng.integers(1, 60))
+	visits_per_session = rng.choice([1, 2, 3, 5, 8], size=session_count, p=[0.4, 0.2, 0.1, 0.2, 0.1])
+	visit_sessions = np.repeat(np.arange(session_count), visits_per_session)
+	visits_df = pd.DataFrame({
+		'session_id': visit_sessions.astype('int32'),
+		'visit_id': np.arange(len(visit_sessions), dtype='int32'),
+	}).sample(frac=1, random_state=seed).reset_index(drop=True)
+	events_per_session = rng.integers(0, 6, size=session_count) * (rng.random(session_count) > 0.3)
+	event_sessions = np.repeat(np.arange(session_count), events_per_session)
+	event_ids = np.arange(len(event_sessions))
+	repeated = rng.random(len(event_ids)) < 0.2
+	events_df = pd.DataFrame({
+		'session_id': np.concatenate([event_sessions, event_sessions[repeated]]).astype('int32'),
+		'event_id': np.concatenate([event_ids, event_ids[repeated]]).astype('int32'),
+	}).sample(frac=1, random_state=seed).reset_index(drop=True)
+	return visits_df, events_df
+
+@pytest.mark.parametrize('seed', range(50))
+def test_matches_reference (seed):
+	visits_df, events_df = random_frames(seed)
+	assert count_repeat_visitors(visits_df, events_df) == reference_repeat_visitors(visits_df, events_df)
+
+def test_empty_buckets_and_sessions_without_events ():
+	# Session 0 visits once, session 1 four times (so nobody is in the 2 and 3 buckets), session 2 twice without any events
+	visits_df = pd.DataFrame({'session_id': np.array([0, 1, 1, 1, 1, 2, 2], dtype='int32'), 'visit_id': np.arange(7, dtype='int32')})
+	events_df = pd.DataFrame({'session_id': np.array([0, 0, 1, 1], dtype='int32'), 'event_id': np.array([0, 1, 2, 2], dtype='int32')})
+	expected = [[1, 2], [1, 0], [0, 0], [1, 1]]
+	assert reference_repeat_visitors(visits_df, events_df) == expected
+	assert count_repeat_visitors(visits_df, events_df) == expected
+
+def test_missing_session_ids_are_no_users ():
+	visits_df, events_df = random_frames(0)
+	with_missing = pd.concat([visits_df, pd.DataFrame({'session_id': np.array([-1, -1], dtype='int32'), 'visit_id': np.array([-1, 10000], dtype='int32')})], ignore_index=True)
+	assert count_repeat_visitors(with_missing, events_df) == reference_repeat_visitors(visits_df, events_df)
+
+def test_no_visits ():
+	visits_df, events_df = random_frames(0)
+	assert count_repeat_visitors(visits_df.iloc[:0], events_df) == reference_repeat_visitors(visits_df.iloc[:0], events_df) == []
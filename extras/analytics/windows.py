@@ -0,0 +1,60 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Batch reports cover many (start_bound, end_bound) windows of the same cleaned frames
+# Windows use the same bounds as a single report (created_at > start_bound and < end_bound), so every window's report is exactly what a single run with those bounds prints
+PERIOD_LENGTHS = {
+	'daily': pd.DateOffset(days=1),
+	'weekly': pd.DateOffset(weeks=1),
+	'monthly': pd.DateOffset(months=1),
+}
+PERIOD_PATTERN = re.compile(r'^\s*(?P<period>\w+)\s+since\s+(?P<since>.+?)(?:\s+until\s+(?P<until>.+?))?\s*$')
+
+def parse_period (text, parse_bound):
+	# 'weekly since 2025-12-13' or 'monthly since 2025-12-01 until 2026-03-01' -> (period length, since, until or None)
+	match = PERIOD_PATTERN.match(text)
+	if not match or match['period'] not in PERIOD_LENGTHS:
+		raise ValueError(f'Invalid period {text!r}, expected e.g. "weekly since 2025-12-13" ({'/'.join(PERIOD_LENGTHS)}, optionally followed by "until <date>")')
+	return PERIOD_LENGTHS[match['period']], parse_bound(match['since']), (parse_bound(match['until']) if match['until'] else None)
+
+def period_windows (length, since, until=None, last_record=None):
+	# Consecutive windows of one period length from since, until one reaches until (the last one is cut short there)
+	# Without until, windows continue until one contains last_record (e.g. the latest cleaned record)
+	windows = []
+	start = pd.Timestamp(since)
+	while (start < pd.Timestamp(until)) if until else (pd.notna(last_record) and start <= pd.Timestamp(last_record)):
+		end = start + length
+		if until: end = min(end, pd.Timestamp(until))
+		windows.append((start.to_pydatetime(), end.to_pydatetime()))
+		start = start + length
+	return windows
+
+class WindowIndex:
+	# Every frame's rows sorted by created_at once, so a window's rows are a searchsorted slice of that order instead of a scan over the whole frame
+	# Slices are put back in frame order before use, so value_counts()/groupby(sort=False) ties come out the same as with a boolean mask
+	def __init__ (self, frames):
+		self.frames = frames
+		self.orders = {}
+		self.sorted_times = {}
+		self.timed_rows = {}
+		for name, frame in frames.items():
+			times = frame['created_at'].to_numpy(dtype='datetime64[ns]')
+			order = np.argsort(times, kind='stable') # NaT sorts last
+			self.orders[name] = order
+			self.sorted_times[name] = times[order]
+			self.timed_rows[name] = len(times) - int(np.isnat(times).sum())
+
+	def rows (self, start_bound=None, end_bound=None):
+		frames = {}
+		for name, frame in self.frames.items():
+			sorted_times = self.sorted_times[name]
+			first, last = 0, len(sorted_times)
+			if start_bound or end_bound:
+				last = self.timed_rows[name] # a NaT created_at is never inside bounds
+			if start_bound:
+				first = int(np.searchsorted(sorted_times[:last], np.datetime64(pd.Timestamp(start_bound).as_unit('ns')), side='right'))
+			if end_bound:
+				last = int(np.searchsorted(sorted_times[:last], np.datetime64(pd.Timestamp(end_bound).as_unit('ns')), side='left'))
+			frames[name] = frame.iloc[np.sort(self.orders[name][first:max(first, last)])]
+		return frames